@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import time, threading
+import numpy as np
+
+try:
+	import pyaudio
+except ImportError:
+	pyaudio = None # offline rendering only
+
+from pcm_writer import PcmWriter
+
+# same values as pyaudio's, to be returned by the stream callbacks
+paContinue = 0
+paComplete = 1
+paAbort = 2
+
+class PortAudioBackend():
+	def __init__(self):
+		self.p = None
+		self.output_device_index = -1
+
+	def open(self, rate, frames_per_buffer, stream_callback):
+		if self.p is None:
+			if pyaudio is None:
+				raise Exception("pyaudio is needed to play sound, only offline rendering is available!")
+			self.p = pyaudio.PyAudio()
+			for i in range(self.p.get_device_count()):
+				name = self.p.get_device_info_by_index(i)['name']
+				if 'pipewire' in name:
+					self.output_device_index = i
+				print("%2d %s%s" % (i, "*" if self.output_device_index == i else "", name))
+
+		return self.p.open(format=pyaudio.paFloat32, channels=1, rate=int(rate), output=True, output_device_index=self.output_device_index, stream_callback=stream_callback, frames_per_buffer=frames_per_buffer)
+
+	def terminate(self):
+		if self.p is not None:
+			self.p.terminate()
+			self.p = None
+
+class SimulatedStream():
+	# same interface as a pyaudio stream, the callback is called from our own thread
+	# on a simulated clock, running speed times faster than real time (or as fast as possible if speed is None)
+	def __init__(self, backend, rate, frames_per_buffer, stream_callback, speed):
+		self.backend = backend
+		self.rate = float(rate)
+		self.frames_per_buffer = frames_per_buffer
+		self.callback = stream_callback
+		self.speed = speed
+		self.frames = 0
+		self.active = False
+		self.thread = None
+
+	def time(self):
+		return self.frames / self.rate
+
+	def step(self):
+		timeInfo = {'input_buffer_adc_time': 0, 'current_time': self.time(), 'output_buffer_dac_time': self.time()}
+		data, flag = self.callback(None, self.frames_per_buffer, timeInfo, 0)
+		if isinstance(data, bytes):
+			samples = np.frombuffer(data, dtype=np.float32)
+		else:
+			samples = np.asarray(data, dtype=np.float32)
+		self.backend.consume(samples[:self.frames_per_buffer])
+		self.frames+=self.frames_per_buffer
+		if flag != paContinue:
+			self.active = False
+		return self.active
+
+	def run(self):
+		start = time.monotonic()
+		while self.active:
+			if self.speed:
+				delay = start + self.time() / self.speed - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+			self.step()
+
+	def start_stream(self):
+		if not self.active:
+			self.active = True
+			self.thread = threading.Thread(target=self.run, name="Simulated Stream")
+			self.thread.daemon = True
+			self.thread.start()
+
+	def stop_stream(self):
+		self.active = False
+		if self.thread is not None and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread = None
+
+	def close(self):
+		self.stop_stream()
+		self.backend.closeStream(self)
+
+	def is_active(self):
+		return self.active
+
+class SimulatedClockBackend():
+	def __init__(self, speed=1.0):
+		self.speed = speed
+		self.frames = 0
+
+	def open(self, rate, frames_per_buffer, stream_callback):
+		return SimulatedStream(self, rate, frames_per_buffer, stream_callback, self.speed)
+
+	def consume(self, samples):
+		self.frames+=len(samples)
+
+	def closeStream(self, stream):
+		pass
+
+	def terminate(self):
+		pass
+
+class FileBackend(SimulatedClockBackend):
+	def __init__(self, filename, sampleFormat='float32', raw=False, speed=1.0):
+		SimulatedClockBackend.__init__(self, speed)
+		self.filename = filename
+		self.sampleFormat = sampleFormat
+		self.raw = raw
+		self.writer = None
+
+	def open(self, rate, frames_per_buffer, stream_callback):
+		if self.writer is None:
+			self.writer = PcmWriter(self.filename, rate, self.sampleFormat, self.raw)
+		return SimulatedClockBackend.open(self, rate, frames_per_buffer, stream_callback)
+
+	def consume(self, samples):
+		SimulatedClockBackend.consume(self, samples)
+		self.writer.write(samples)
+
+	def terminate(self):
+		if self.writer is not None:
+			self.writer.close()
+			self.writer = None
+
+BACKENDS = ['portaudio', 'null', 'simulated', 'file:FILENAME']
+
+def makeBackend(name='portaudio', speed=None):
+	if name == 'portaudio':
+		return PortAudioBackend()
+	# the producers pace themselves on the callback, the GUI backends run in real time unless told otherwise
+	elif name in ('null', 'simulated'):
+		return SimulatedClockBackend(speed or 1.0)
+	elif name.startswith('file:'):
+		return FileBackend(name[5:], speed=speed or 1.0)
+	raise Exception("Unknown audio backend %s, should be one of %s!" % (name, ", ".join(BACKENDS)))
+
+def addBackendArguments(parser):
+	parser.add_argument('--backend', default='portaudio', help="audio output, one of %s (default: %%(default)s)" % ", ".join(BACKENDS))
+	parser.add_argument('--speed', type=float, default=None, help="clock speed factor of the null, simulated and file backends (default: real time)")
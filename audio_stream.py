@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from buffer_ring import BufferRing
+from process_worker import SynthesisProcess
+
+def startStream(engine, frames, buffers, startProducer, **kwargs):
+	# ring of buffers rendered by startProducer(), or by a synthesis process (made with kwargs) in process mode,
+	# then the audio stream playing them with engine.callback
+	if engine.useProcess:
+		engine.ring = engine.worker = SynthesisProcess(engine, buffers, frames, engine.PROCESS_STATUS, **kwargs)
+	else:
+		engine.ring = BufferRing(buffers, frames)
+	if engine.tuner is not None:
+		engine.tuner.attach(engine.ring)
+	if not engine.useProcess:
+		startProducer()
+
+	# the stream starts once the lookahead is filled
+	engine.ring.waitReady(engine.ring.limit)
+
+	engine.stream = engine.backend.open(rate=engine.fs, frames_per_buffer=frames, stream_callback=engine.callback)
+	engine.stream.start_stream()
+
+def addStreamArguments(parser, bufferSize=True):
+	if bufferSize:
+		parser.add_argument('--frames-per-buffer', type=int, default=1000, help="audio buffers size (default: %(default)s)")
+		parser.add_argument('--buffers', type=int, default=3, help="audio buffers ring depth, more is safer against underruns but adds latency (default: %(default)s)")
+	parser.add_argument('--process', action='store_true', help="synthesize in a separate process, away from the GUI")
+	parser.add_argument('--stats-log', type=float, metavar='SECONDS', help="periodically print the audio stream statistics")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys, time, json, argparse, platform, itertools
+import numpy as np
+
+import sound_generator, pulse_generator, v23_generator
+
+SAMPLING_RATES = [22050, 44100, 96000, 192000]
+PERCENTILES = [50, 90, 99, 100]
+
+def measure(render, prepare, frames, buffers):
+	buf = np.zeros(frames).astype(np.float32)
+	durations = []
+	for i in range(buffers):
+		prepare()
+		start = time.perf_counter()
+		render(buf)
+		durations.append(time.perf_counter() - start)
+	return np.array(durations)
+
+def soundGeneratorCases(fs):
+	for waveForm, name in enumerate(sound_generator.WAVEFORMS):
+		sound = sound_generator.SoundGenerator(fs=fs)
+		sound.setFrequency(1000)
+		sound.setWaveFormType(waveForm)
+		sound.setVolume(0.5)
+		sound.loopEnabled = False # the synthesis itself
+		yield "sound_generator", name, sound.render, lambda: None
+
+	# steady tone replayed from its loop
+	sound = sound_generator.SoundGenerator(fs=fs)
+	sound.setFrequency(1000.37)
+	sound.setVolume(0.5)
+	yield "sound_generator", "sine loop", sound.render, lambda: None
+
+def pulseGeneratorCases(fs):
+	for mode, name in ((pulse_generator.PulsingSoundGenerator.REST_PERIOD, "rest"), (pulse_generator.PulsingSoundGenerator.CSTFREQ_PERIOD, "cstfreq"), (pulse_generator.PulsingSoundGenerator.VARFREQ_PERIOD, "varfreq")):
+		sound = pulse_generator.PulsingSoundGenerator(fs=fs, threaded=False)
+		sound.setFrequency(50)
+		sound.setFrequencyRaiseRate(4)
+		sound.setConstantFrequencyDuration(duration=1000)
+		sound.setVolume(0.5)
+		sound.setVolumeRaiseRate(1)
+		sound.reset()
+		sound.templatesEnabled = False # the synthesis itself
+
+		# stay in the same period mode for the whole run
+		def prepare(sound=sound, mode=mode):
+			if mode != sound.REST_PERIOD and sound.periodMode == sound.REST_PERIOD:
+				sound.setActive(True)
+			sound.periodMode = mode
+			if mode == sound.VARFREQ_PERIOD and sound.frequency > 1.5 * sound.baseFrequency:
+				sound.frequency = sound.baseFrequency
+
+		yield "pulse_generator", name, sound.render, prepare
+
+	# pulses of 10 buffers every 20 buffers, replayed from their template after the first one
+	sound = pulse_generator.PulsingSoundGenerator(fs=fs, threaded=False)
+	sound.setFrequency(50)
+	sound.setFrequencyRaiseRate(4)
+	sound.setVolume(0.5)
+	sound.setVolumeRaiseRate(1)
+	sound.reset()
+	buffers = itertools.count()
+	def prepare(sound=sound, buffers=buffers):
+		n = next(buffers) % 20
+		if n == 0:
+			sound.setActive(True)
+		elif n == 10:
+			sound.setActive(False)
+
+	yield "pulse_generator", "pulses", sound.render, prepare
+
+def v23GeneratorCases(fs):
+	for baudRate in (75, 300, 600, 1200):
+		sound = v23_generator.SoundGenerator(fs=fs)
+		sound.setBaudRate(baudRate)
+		sound.setVolume(0.1)
+		sound.reset(initialBreak=False)
+		sound.waitSamples = 0
+		data = np.random.RandomState(0).randint(0, 128, 4096).astype(np.uint8).tobytes()
+
+		def prepare(sound=sound, data=data):
+			if sound.queuedSeconds() < 1:
+				sound.write(data)
+
+		yield "v23_generator", "%d bauds" % baudRate, sound.render, prepare
+
+def run(frames, buffers, samplingRates, engines):
+	results = []
+	for fs in samplingRates:
+		for cases in engines:
+			for engine, case, render, prepare in cases(fs):
+				measure(render, prepare, frames, min(buffers, 10)) # warm up
+				durations = measure(render, prepare, frames, buffers)
+				bufferDuration = frames / float(fs)
+				results.append({
+					'engine': engine,
+					'case': case,
+					'fs': fs,
+					'frames_per_buffer': frames,
+					'buffers': buffers,
+					'samples_per_second': frames / durations.mean(),
+					'realtime_factor': bufferDuration / durations.mean(),
+					'worst_realtime_factor': bufferDuration / durations.max(),
+					'latency_percentiles_us': dict(("p%d" % p, float(np.percentile(durations, p) * 1e6)) for p in PERCENTILES),
+				})
+	return results
+
+def main():
+	engines = {'sound': soundGeneratorCases, 'pulse': pulseGeneratorCases, 'v23': v23GeneratorCases}
+	parser = argparse.ArgumentParser(description="Synthesis throughput and real time headroom benchmark, without any sound card.")
+	parser.add_argument('--frames', type=int, default=1000, help="frames per buffer (default: %(default)s)")
+	parser.add_argument('--buffers', type=int, default=200, help="buffers rendered per case (default: %(default)s)")
+	parser.add_argument('--fs', type=int, nargs='+', default=SAMPLING_RATES, help="sampling rates in Hz (default: %(default)s)")
+	parser.add_argument('--engine', choices=engines, nargs='+', default=list(engines), help="engines to benchmark (default: all)")
+	parser.add_argument('--json', metavar='FILE', help="write the results as JSON ('-' for stdout)")
+	args = parser.parse_args()
+
+	results = run(args.frames, args.buffers, args.fs, [engines[e] for e in args.engine])
+
+	if args.json:
+		report = {
+			'time': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+			'python': platform.python_version(),
+			'numpy': np.__version__,
+			'machine': platform.machine(),
+			'platform': platform.platform(),
+			'results': results,
+		}
+		if args.json == '-':
+			json.dump(report, sys.stdout, indent=1)
+			print()
+		else:
+			with open(args.json, "w") as fd:
+				json.dump(report, fd, indent=1)
+
+	if args.json != '-':
+		print("%-16s %-10s %7s %14s %9s %9s %9s %9s %9s" % ("engine", "case", "fs", "samples/s", "RT factor", "p50 us", "p90 us", "p99 us", "max us"))
+		for r in results:
+			p = r['latency_percentiles_us']
+			print("%-16s %-10s %7d %14.0f %9.1f %9.1f %9.1f %9.1f %9.1f" % (r['engine'], r['case'], r['fs'], r['samples_per_second'], r['realtime_factor'], p['p50'], p['p90'], p['p99'], p['p100']))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import numpy as np
+
+class BufferRing():
+	# depth distinct preallocated buffers, filled by a producer and handed to a consumer in order.
+	# The buffer last handed to the consumer is still in flight until the next pop(), so the
+	# producer can't have more than depth-1 buffers ready and never overwrites it.
+	# limit lowers that number of ready buffers (the lookahead) without reallocating the ring.
+	def __init__(self, depth, frames):
+		if depth < 2:
+			raise Exception("A buffer ring needs at least 2 buffers!")
+		self.depth = depth
+		self.frames = frames
+		self.buffers = [np.zeros(frames).astype(np.float32) for i in range(depth)]
+		self.condition = threading.Condition()
+		self.limit = depth - 1
+		self.clear()
+
+	def clear(self):
+		with self.condition:
+			self.writeIndex = 0 # next buffer to be filled by the producer
+			self.readIndex = 0 # next buffer to be handed to the consumer
+			self.ready = 0
+			self.inFlight = None
+			self.condition.notify_all()
+
+	def waitReady(self, count=1, timeout=None):
+		# until count buffers are ready (at most depth-1), returns False on timeout
+		with self.condition:
+			return self.condition.wait_for(lambda: self.ready >= min(count, self.limit), timeout)
+
+	def isFull(self):
+		return self.ready >= self.limit
+
+	def setLimit(self, limit):
+		with self.condition:
+			self.limit = max(1, min(limit, self.depth - 1))
+			self.condition.notify_all()
+
+	def acquire(self, timeout=None):
+		# producer side: buffer to fill, or None if none got free before timeout
+		with self.condition:
+			if not self.condition.wait_for(lambda: not self.isFull(), timeout):
+				return None
+			return self.buffers[self.writeIndex]
+
+	def commit(self):
+		with self.condition:
+			self.writeIndex = (self.writeIndex + 1) % self.depth
+			self.ready+=1
+			self.condition.notify_all()
+
+	def pop(self):
+		# consumer side: next ready buffer, or None on underrun. Doesn't wait.
+		with self.condition:
+			if not self.ready:
+				return None
+			self.inFlight = self.readIndex
+			self.readIndex = (self.readIndex + 1) % self.depth
+			self.ready-=1
+			self.condition.notify_all()
+			return self.buffers[self.inFlight]
+
+	def qsize(self):
+		return self.ready
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import sys, time, threading
+import numpy as np
+
+from audio_backends import FileBackend, paContinue
+from buffer_ring import BufferRing
+
+class LatencyTuner():
+	# buffer sizes tried, smallest first
+	FRAMES = [64, 128, 256, 512, 1024, 2048, 4096, 8192]
+	CALIBRATION_TIME = 0.1 # seconds of sound rendered per buffer size
+	TRIAL_TIME = 2.0 # seconds of silence played through the audio output per configuration, rendering meanwhile
+	RELAX_TIME = 30.0 # seconds without underrun before giving back a buffer of lookahead
+
+	# picks the smallest buffer size and ring depth keeping the rendering time headroom times
+	# below the buffer duration (and the lookahead above the worst rendering time), between minLatency and maxLatency
+	def __init__(self, minLatency=0.005, maxLatency=0.25, headroom=4.0):
+		if minLatency > maxLatency:
+			raise Exception("The minimum latency should be lower than the maximum one!")
+		self.minLatency = minLatency
+		self.maxLatency = maxLatency
+		self.headroom = headroom
+		self.frames = None
+		self.limit = None
+		self.underruns = 0
+		self.stableCallbacks = 0
+		self.relaxCallbacks = None
+		# buffer size and lookahead chosen per sampling rate, the trials taking seconds
+		self.calibrations = {}
+		self.calibrationLock = threading.Lock()
+
+	def measure(self, render, frames, count):
+		buf = np.zeros(frames).astype(np.float32)
+		render(buf) ; render(buf) # warm up
+		durations = []
+		for i in range(count):
+			start = time.perf_counter()
+			render(buf)
+			durations.append(time.perf_counter() - start)
+		return np.array(durations)
+
+	def trial(self, backend, render, fs, frames, limit):
+		# underruns of a real time run through the audio output, rendering with a producer thread like the engines do
+		ring = BufferRing(limit + 1, frames)
+		silence = np.zeros(frames).astype(np.float32)
+		underruns = [0]
+		running = threading.Event()
+		running.set()
+
+		def produce():
+			while running.is_set():
+				buf = ring.acquire(timeout=0.1)
+				if buf is not None:
+					render(buf)
+					ring.commit()
+
+		def callback(in_data, frame_count, time_info, status):
+			# the lookahead emptied counts too, a single run being short
+			if ring.pop() is None or status or (limit > 1 and not ring.qsize()):
+				underruns[0]+=1
+			return silence, paContinue
+
+		thread = threading.Thread(target=produce, name="Latency Trial")
+		thread.start()
+		ring.waitReady(limit)
+		stream = backend.open(rate=fs, frames_per_buffer=frames, stream_callback=callback)
+		stream.start_stream()
+		time.sleep(self.TRIAL_TIME / getattr(backend, 'speed', 1.0))
+		stream.stop_stream()
+		stream.close()
+		running.clear()
+		thread.join()
+		return underruns[0]
+
+	def calibrate(self, render, fs, backend=None):
+		# returns the buffer size and the ring depth to allocate, ring depth up to maxLatency for update() to grow the lookahead.
+		# Measured on the first call for fs only (or waits for calibrateInBackground()), update() adapts the lookahead afterwards.
+		with self.calibrationLock:
+			if fs not in self.calibrations:
+				self.calibrations[fs] = self.choose(render, fs, backend)
+			self.frames, self.limit = self.calibrations[fs]
+		buffers = self.limit + 1
+		self.underruns = 0
+		self.stableCallbacks = 0
+		self.relaxCallbacks = int(self.RELAX_TIME * fs / self.frames)
+		return self.frames, max(buffers, int(self.maxLatency * fs / self.frames))
+
+	def calibrateInBackground(self, render, fs, backend=None):
+		# for the GUIs, so that enabling the sound doesn't freeze them through the trials
+		thread = threading.Thread(target=self.calibrate, args=(render, fs, backend), name="Latency Calibration")
+		thread.daemon = True
+		thread.start()
+
+	def choose(self, render, fs, backend=None):
+		# buffer size and lookahead. With backend, the choice is tried in real time through it, and buffer sizes
+		# are stepped up while it underruns.
+		choice = None
+		for frames in self.FRAMES:
+			duration = frames / fs
+			if 2 * duration > self.maxLatency:
+				break
+			durations = self.measure(render, frames, max(8, int(self.CALIBRATION_TIME / duration)))
+			if np.percentile(durations, 99) * self.headroom > duration:
+				continue # can't keep up with enough margin
+
+			# enough buffers ahead to ride out the worst rendering time seen, with the same margin
+			buffers = max(2, int(np.ceil(max(durations.max() * self.headroom, self.minLatency) / duration)))
+			if buffers * duration <= self.maxLatency:
+				choice = frames, buffers
+				break
+
+		if choice is None:
+			# too slow for the bounds, take the most we are allowed
+			frames = max([f for f in self.FRAMES if 2 * f / fs <= self.maxLatency] or self.FRAMES[:1])
+			choice = frames, max(2, int(self.maxLatency * fs / frames))
+
+		frames, buffers = choice
+		limit = self.clampLimit(buffers - 1, frames, fs)
+		if backend is not None and getattr(backend, 'speed', 1.0) and not isinstance(backend, FileBackend):
+			# real time, and nothing recorded
+			while True:
+				underruns = self.trial(backend, render, fs, frames, limit)
+				larger = [f for f in self.FRAMES if f > frames and 2 * f / fs <= self.maxLatency]
+				if not underruns or not larger:
+					break
+				# same lookahead in larger buffers, one more of them
+				print("Latency trial: %d underruns with %d frames x %d buffers" % (underruns, frames, limit + 1), file=sys.stderr)
+				lookahead = limit * frames
+				frames = larger[0]
+				limit = self.clampLimit(int(np.ceil(lookahead / frames)) + 1, frames, fs)
+
+		print("Latency auto-tuned to %d frames x %d buffers (%.1fms)" % (frames, limit + 1, 1000.0 * frames * (limit + 1) / fs), file=sys.stderr)
+		return frames, limit
+
+	def clampLimit(self, limit, frames, fs):
+		# a lookahead (without the buffer in flight) of at least minLatency, and buffers up to maxLatency.
+		# The audio callback waits for the GIL up to a switch interval behind the other Python threads.
+		limit = max(limit, int(np.ceil(max(self.minLatency, 2 * sys.getswitchinterval()) * fs / frames)))
+		return max(1, min(limit, int(self.maxLatency * fs / frames) - 1))
+
+	def attach(self, ring):
+		ring.setLimit(self.limit)
+
+	def update(self, stats, ring):
+		# from the audio callback: one more buffer of lookahead on underruns, one less after a long time without
+		if stats.underruns > self.underruns:
+			self.underruns = stats.underruns
+			self.stableCallbacks = 0
+			if ring.limit < ring.depth - 1:
+				ring.setLimit(ring.limit + 1)
+		else:
+			self.stableCallbacks+=1
+			if self.stableCallbacks >= self.relaxCallbacks and ring.limit > self.limit:
+				ring.setLimit(ring.limit - 1)
+				self.stableCallbacks = 0
+
+def addTunerArguments(parser):
+	parser.add_argument('--auto-latency', action='store_true', help="pick the audio buffers size and number from the measured rendering time, and add buffers on underruns")
+	parser.add_argument('--latency-bounds', type=float, nargs=2, metavar=('MIN', 'MAX'), default=[5, 250], help="auto latency bounds in ms (default: %(default)s)")
+
+def makeTuner(args):
+	if not args.auto_latency:
+		return None
+	return LatencyTuner(args.latency_bounds[0] / 1000.0, args.latency_bounds[1] / 1000.0)
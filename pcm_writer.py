@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import sys, struct
+import numpy as np
+
+class PcmWriter():
+	# WAV format tag, bytes per sample
+	FORMATS = {'float32': (3, 4), 'int16': (1, 2)}
+
+	def __init__(self, filename, fs, sampleFormat='float32', raw=False):
+		if sampleFormat not in self.FORMATS:
+			raise Exception("Unsupported sample format %s, should be one of %s!" % (sampleFormat, ", ".join(self.FORMATS)))
+		self.fs = int(fs)
+		self.sampleFormat = sampleFormat
+		self.formatTag, self.sampleSize = self.FORMATS[sampleFormat]
+		self.raw = raw
+		self.frames = 0
+
+		if filename == '-':
+			self.fd, self.closeFd = sys.stdout.buffer, False
+		else:
+			self.fd, self.closeFd = open(filename, "wb"), True
+
+		if not self.raw:
+			# sizes are unknown yet, they'll be patched on close() if the output is seekable
+			self.fd.write(self.header(None))
+
+	def header(self, frames):
+		fmt = struct.pack('<HHIIHH', self.formatTag, 1, self.fs, self.fs * self.sampleSize, self.sampleSize, self.sampleSize * 8)
+		if self.formatTag != 1:
+			fmt+=struct.pack('<H', 0)
+		chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+		if self.formatTag != 1:
+			chunks+=b'fact' + struct.pack('<II', 4, 0xFFFFFFFF if frames is None else frames)
+
+		dataSize = 0xFFFFFFFF if frames is None else frames * self.sampleSize
+		riffSize = 0xFFFFFFFF if frames is None else 4 + len(chunks) + 8 + dataSize
+		return b'RIFF' + struct.pack('<I', riffSize) + b'WAVE' + chunks + b'data' + struct.pack('<I', dataSize)
+
+	def write(self, samples):
+		if self.sampleFormat == 'int16':
+			data = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+		else:
+			data = np.asarray(samples, dtype='<f4')
+		self.fd.write(data.tobytes())
+		self.frames+=len(data)
+
+	def close(self):
+		if self.fd is None:
+			return
+		if not self.raw:
+			try:
+				self.fd.seek(0)
+				self.fd.write(self.header(self.frames))
+			except (OSError, ValueError):
+				pass # not seekable (pipe), keep the "unknown size" header
+		if self.closeFd:
+			self.fd.close()
+		else:
+			self.fd.flush()
+		self.fd = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import time, threading, functools, multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from buffer_ring import BufferRing
+
+class SharedBufferRing(BufferRing):
+	# BufferRing with its buffers and indexes in shared memory, so that the producer can be another process.
+	# Each slot also carries the time it took to render and a few engine values at the end of it.
+	def __init__(self, depth, frames, statusSize=0, context=None):
+		if depth < 2:
+			raise Exception("A buffer ring needs at least 2 buffers!")
+		context = context or multiprocessing.get_context('spawn')
+		self.depth = depth
+		self.frames = frames
+		self.statusSize = statusSize
+		self.shm = shared_memory.SharedMemory(create=True, size=depth * frames * 4)
+		self.indexes = context.RawArray('l', 6) # writeIndex, readIndex, ready, inFlight (-1 for None), limit, skipped
+		self.slotStatus = context.RawArray('d', depth * (1 + statusSize)) # generation time, status values
+		self.condition = context.Condition()
+		self.owner = True
+		self.limit = depth - 1
+		self.attach()
+		self.clear()
+
+	def attach(self):
+		self.buffers = [np.ndarray(self.frames, dtype=np.float32, buffer=self.shm.buf, offset=i * self.frames * 4) for i in range(self.depth)]
+
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		del state['buffers']
+		state['owner'] = False
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.attach()
+
+	writeIndex = property(lambda self: self.indexes[0], lambda self, value: self.indexes.__setitem__(0, value))
+	readIndex = property(lambda self: self.indexes[1], lambda self, value: self.indexes.__setitem__(1, value))
+	ready = property(lambda self: self.indexes[2], lambda self, value: self.indexes.__setitem__(2, value))
+	inFlight = property(lambda self: None if self.indexes[3] < 0 else self.indexes[3], lambda self, value: self.indexes.__setitem__(3, -1 if value is None else value))
+	limit = property(lambda self: self.indexes[4], lambda self, value: self.indexes.__setitem__(4, value))
+	skipped = property(lambda self: self.indexes[5], lambda self, value: self.indexes.__setitem__(5, value)) # frames played without a buffer
+
+	def pop(self, skipFrames=0):
+		# on underrun, the consumer plays skipFrames frames of its own, counted at once for the producer
+		# not to commit a buffer in between that doesn't follow them
+		with self.condition:
+			buf = BufferRing.pop(self)
+			if buf is None:
+				self.skipped+=skipFrames
+			return buf
+
+	def commit(self, generationTime=0, status=()):
+		offset = self.writeIndex * (1 + self.statusSize)
+		self.slotStatus[offset] = generationTime
+		self.slotStatus[offset + 1:offset + 1 + len(status)] = status
+		BufferRing.commit(self)
+
+	def inFlightStatus(self):
+		# generation time and status values of the buffer last popped
+		offset = self.inFlight * (1 + self.statusSize)
+		return self.slotStatus[offset], self.slotStatus[offset + 1:offset + 1 + self.statusSize]
+
+	def close(self):
+		self.buffers = None
+		try:
+			self.shm.close()
+		except BufferError:
+			pass # a buffer is still referenced, the mapping goes away with it
+		if self.owner:
+			self.shm.unlink()
+
+class RemoteStream():
+	# stands for the parent's audio stream in the synthesis process, for the engines checking whether they are playing
+	def is_active(self):
+		return True
+
+	def stop_stream(self):
+		pass
+
+	def close(self):
+		pass
+
+def forwarded(method):
+	# setter run on the local engine, and on the one in the synthesis process if there is one
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		result = method(self, *args, **kwargs)
+		if getattr(self, 'worker', None) is not None:
+			self.worker.call(method.__name__, *args, **kwargs)
+		return result
+	return wrapper
+
+def getPath(o, path):
+	for name in path.split('.'):
+		o = getattr(o, name)
+	return o
+
+def setPath(o, path, value):
+	names = path.split('.')
+	for name in names[:-1]:
+		o = getattr(o, name)
+	# shared as floats, give the integer attributes (modes, counters) their type back
+	if isinstance(getattr(o, names[-1]), int) and value.is_integer():
+		value = int(value)
+	setattr(o, names[-1], value)
+
+# engine attributes worth copying to the synthesis process, the others are rebuilt there
+STATE_TYPES = (bool, int, float, str, type(None), list, np.ndarray, np.generic)
+
+def engineState(engine):
+	return dict((name, value.copy() if isinstance(value, (list, np.ndarray)) else value) for name, value in engine.__dict__.items() if isinstance(value, STATE_TYPES))
+
+def cloneEngine(engine, **kwargs):
+	# same parameters in a new engine, to render without touching the original
+	clone = type(engine)(**kwargs)
+	clone.__dict__.update(engineState(engine))
+	return clone
+
+def synthesisProcessMain(engineClass, kwargs, state, ring, commands, statusNames):
+	engine = engineClass(**kwargs)
+	engine.__dict__.update(state)
+	engine.stream = RemoteStream()
+	skipped = 0
+
+	while True:
+		with ring.condition:
+			ring.condition.wait_for(lambda: not ring.isFull() or commands.poll(), 1)
+
+		while commands.poll():
+			command = commands.recv()
+			if command is None:
+				ring.close()
+				return
+			name, args, kwargs = command
+			getattr(engine, name)(*args, **kwargs)
+
+		# only this process makes the ring fuller
+		if not ring.isFull():
+			buf = ring.buffers[ring.writeIndex]
+			start = time.perf_counter()
+			engine.render(buf)
+			generationTime = time.perf_counter() - start
+			# the frames the parent played on underruns meanwhile come before this buffer, engines
+			# with a skipFrames() method make it follow them
+			while True:
+				with ring.condition:
+					if ring.skipped == skipped or not hasattr(engine, 'skipFrames'):
+						ring.commit(generationTime, [float(getPath(engine, name)) for name in statusNames])
+						break
+					frames = ring.skipped - skipped
+					skipped = ring.skipped
+				engine.skipFrames(buf, frames)
+
+class SynthesisProcess():
+	# runs engine.render() in another process, away from the GUI's GIL, through a shared memory ring.
+	# Same consumer side interface as BufferRing. Setters are replayed there with call(), and after each
+	# buffer handed to the audio callback, the statusNames engine attributes are updated from the values
+	# the process had when it rendered it.
+	def __init__(self, engine, depth, frames, statusNames=(), **kwargs):
+		context = multiprocessing.get_context('spawn')
+		self.engine = engine
+		self.statusNames = list(statusNames)
+		self.ring = SharedBufferRing(depth, frames, len(self.statusNames), context)
+		self.commands, commands = context.Pipe(duplex=False)[::-1]
+		self.commandsLock = threading.Lock()
+
+		self.process = context.Process(target=synthesisProcessMain, args=(type(engine), kwargs, engineState(engine), self.ring, commands, self.statusNames), name="Synthesis Process")
+		self.process.daemon = True
+		self.process.start()
+		commands.close()
+
+	def call(self, name, *args, **kwargs):
+		self.send((name, args, kwargs))
+
+	def send(self, command):
+		with self.commandsLock:
+			self.commands.send(command)
+		with self.ring.condition:
+			self.ring.condition.notify_all()
+
+	def waitReady(self, count=1, timeout=None):
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while not self.ring.waitReady(count, 0.1):
+			if not self.process.is_alive():
+				raise Exception("The synthesis process died!")
+			if deadline is not None and time.monotonic() > deadline:
+				return False
+		return True
+
+	def pop(self, skipFrames=0):
+		buf = self.ring.pop(skipFrames)
+		if buf is not None:
+			generationTime, status = self.ring.inFlightStatus()
+			self.engine.stats.recordGeneration(generationTime)
+			for name, value in zip(self.statusNames, status):
+				setPath(self.engine, name, value)
+		return buf
+
+	def qsize(self):
+		return self.ring.qsize()
+
+	depth = property(lambda self: self.ring.depth)
+	limit = property(lambda self: self.ring.limit)
+
+	def setLimit(self, limit):
+		self.ring.setLimit(limit)
+
+	def stop(self):
+		try:
+			self.send(None) # quit
+		except (OSError, ValueError):
+			pass
+		self.process.join(1)
+		if self.process.is_alive():
+			self.process.terminate()
+			self.process.join()
+		self.commands.close()
+		self.ring.close()
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sys, os, time, queue
-import numpy as np, pyaudio
+import sys, os, time, argparse, threading, functools, bisect, collections, heapq
+import numpy as np
 
 try:
 	# sudo apt-get install python3-pyqt5
@@ -11,13 +11,48 @@ try:
 	from PyQt5.QtCore import *
 	from PyQt5.QtWidgets import *
 	PYQT_VERSION = 5
-	print("Using PyQt5")
+	print("Using PyQt5", file=sys.stderr)
 except:
 	# sudo apt-get install python-qtpy python3-qtpy
 	from PyQt4.QtGui import *
 	from PyQt4.QtCore import *
 	PYQT_VERSION = 4
-	print("Using PyQt4")
+	print("Using PyQt4", file=sys.stderr)
+
+from pcm_writer import PcmWriter
+from audio_backends import PortAudioBackend, makeBackend, addBackendArguments, paContinue, paComplete
+from stream_stats import StreamStats
+from process_worker import forwarded, cloneEngine
+from audio_stream import startStream, addStreamArguments
+from latency_tuner import addTunerArguments, makeTuner
+from wavetable import getWavetable, tuningWord, tuningWords, wordFrequency, TURN, PHASE_TYPE
+
+def onProducerThread(method):
+	# while the producer thread renders, setters are queued for it to run them before its next buffer,
+	# for the engine state to be written by one thread only
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		if self.running.is_set() and threading.get_ident() != self.producerId:
+			self.commands.append((method, args, kwargs))
+		else:
+			method(self, *args, **kwargs)
+	return wrapper
+
+class PulseTemplate():
+	# samples of a pulse from its start, and the engine state at the end of each buffer they were rendered in
+	def __init__(self, state):
+		self.samples = np.zeros(0, dtype=np.float32)
+		self.length = 0
+		self.positions = [0]
+		self.states = [state]
+
+	def append(self, buf, state):
+		if self.length + len(buf) > len(self.samples):
+			self.samples = np.concatenate((self.samples[:self.length], np.zeros(max(self.length, 4*len(buf)), dtype=np.float32)))
+		self.samples[self.length:self.length+len(buf)] = buf
+		self.length+=len(buf)
+		self.positions.append(self.length)
+		self.states.append(state)
 
 class PulsingSoundGenerator(QObject):
 	SINE = 0
@@ -27,15 +62,28 @@ class PulsingSoundGenerator(QObject):
 	REST_PERIOD = 0
 	CSTFREQ_PERIOD = 1
 	VARFREQ_PERIOD = 2
+	# scheduled events, ends first when at the same sample
+	PULSE_OFF = 0
+	PULSE_ON = 1
+	# mirrored from the synthesis process
+	PROCESS_STATUS = ['phase', 'volume', 'frequency', 'periodMode', 'currentVolumeFactor', 'currentTimeInCycle']
+	# pulses starting from silence with the same parameters are the same, replayed from templates recorded
+	# up to TEMPLATE_MAX_SECONDS, for TEMPLATE_PHASES start phases (the jump to the closest is silent)
+	TEMPLATE_STATE = ['phase', 'volume', 'newVolume', 'frequency', 'periodMode', 'currentVolumeFactor', 'currentTimeInCycle']
+	TEMPLATE_MAX_SECONDS = 10.0
+	TEMPLATE_PHASES = 4
+	TEMPLATE_SILENCE = 1e-4 # volume left from the previous pulse
+	TEMPLATES_NBR = 8
 
 	error = pyqtSignal(str)
 
-	def __init__(self, fs=22050):
+	def __init__(self, fs=22050, threaded=True, backend=None, process=False):
 		QObject.__init__(self)
 		self.newFrequency = None
 		self.newVolume = 0
 		self.fs = float(fs)
 		self.waveFormType = self.SINE
+		self.wavetableCacheDir = None
 		self.periodMode = self.REST_PERIOD
 		self.volume = 0
 		self.frequency = 0
@@ -49,185 +97,397 @@ class PulsingSoundGenerator(QObject):
 		self.deltaPhase = 0 ; self.deltaTime = 0
 		self.currentTimeInCycle = 0
 		self.constantFrequencyDuration = 1
+		self.phase = 0 # DDS phase accumulator
+		self.volumeDecay = 0.998**np.arange(1, 257)
 		self.stream = None
-		self.p = pyaudio.PyAudio()
-		self.output_device_index = -1
+		self.backend = backend if backend is not None else PortAudioBackend()
+		self.stats = StreamStats()
 		self.frames_per_buffer = None
-
-		for i in range(self.p.get_device_count()):
-			name = self.p.get_device_info_by_index(i)['name']
-			if 'pipewire' in name:
-				self.output_device_index = i
-			print("%2d %s%s" % (i, "*" if self.output_device_index == i else "", name))
-
-		self.thread = QThread()
-		self.thread.setObjectName("Sound Thread")
-		self.moveToThread(self.thread)
-		self.thread.started.connect(self._run)
-		self.thread.start()
+		self.ring = None
+		self.running = threading.Event() # wakes up the producer thread
+		self.producerId = None
+		self.commands = collections.deque() # (setter, args, kwargs) queued for the producer thread
+		self.useProcess = process
+		self.worker = None
+		self.tuner = None
+		self.templatesEnabled = True
+		self.templates = collections.OrderedDict()
+		self.template = None
+		self.templatePosition = 0
+		self.templateLag = 0
+		self.pulseStarting = False
+		self.pulseRate = 0 # in min^-1, 0 without repetition
+		self.pulseDuration = 1.0
+		self.manualPulse = False # scheduled pulses are ignored meanwhile
+		self.sampleClock = 0 # samples rendered since reset()
+		self.pulseEvents = [] # heap of (sample, PULSE_OFF or PULSE_ON)
+		self.pulseScheduleChanged = False
+
+		if threaded:
+			self.thread = QThread()
+			self.thread.setObjectName("Sound Thread")
+			self.moveToThread(self.thread)
+			self.thread.started.connect(self._run)
+			self.thread.start()
 
 	def start(self, fs=None, frames_per_buffer=1000, buffers=3):
 		if self.stream is None:
 			if fs:
 				self.fs = float(fs)
 
-			self.buffers = buffers * [np.zeros(frames_per_buffer).astype(np.float32)]
-			self.queue = queue.Queue(maxsize=buffers-1)
-			self.buf_idx = 0
-			self.bufferPreRoll = 20
-			self.phase = 0
-			self.currentVolumeFactor = 0
-			self.deltaTime = 1/self.fs
+			# queued while stopping
+			self.runCommands()
+			self.reset()
+			self.stats.reset()
+			if self.tuner is not None:
+				frames_per_buffer, buffers = self.tuner.calibrate(self.calibrationEngine().render, self.fs, self.backend)
 			self.frames_per_buffer = frames_per_buffer
-
-			while not self.queue.full():
-				time.sleep(0.1)
-
-			self.stream = self.p.open(format=pyaudio.paFloat32, channels=1, rate=int(self.fs), output=True, output_device_index=self.output_device_index, stream_callback=self.callback, frames_per_buffer=frames_per_buffer)
-			self.stream.start_stream()
+			# the producer thread is already waiting
+			startStream(self, frames_per_buffer, buffers, self.running.set, threaded=False)
+
+	def calibrationEngine(self):
+		# calibrated on the most expensive period mode
+		engine = cloneEngine(self, threaded=False)
+		engine.setActive(True)
+		return engine
+
+	def reset(self):
+		self.template = None
+		self.templateLag = 0
+		self.pulseStarting = False
+		self.sampleClock = 0
+		self.pulseEvents = []
+		self.pulseScheduleChanged = True
+		self.phase = 0
+		self.currentVolumeFactor = 0
+		self.deltaTime = 1/self.fs
 
 	def stop(self):
 		self.frames_per_buffer = None
-
-		while not self.queue.empty():
-			try:
-				self.queue.get(block=False)
-
-			except queue.Empty:
-				continue
+		self.running.clear()
+		if self.worker is None and self.ring is not None:
+			self.ring.clear()
 
 		if self.stream:
 			s, self.stream = self.stream, None
 			s.stop_stream()
 			s.close()
 
+		if self.worker is not None:
+			self.worker.stop()
+			self.worker = None
+
 	def _run(self):
+		self.producerId = threading.get_ident()
 		while not self.thread.isInterruptionRequested():
-			if self.frames_per_buffer:
+			if self.running.wait(timeout=1):
 				self.generate()
-			else:
-				time.sleep(1)
 
 	def callback(self, in_data, frame_count, time_info, status):
-		if self.queue.empty():
+		buf = self.ring.pop()
+		if buf is None:
+			self.stats.recordUnderrun()
+			self.stats.recordCallback(status, 0)
+			if self.tuner is not None:
+				# the tuner adds a buffer of lookahead, keep going
+				self.tuner.update(self.stats, self.ring)
+				return (np.zeros(frame_count).astype(np.float32), paContinue)
 			self.error.emit("Buffer underrun!\nYour system is probaby too slow to run the generating code in real time.")
-			return (np.zeros(self.frames_per_buffer), pyaudio.paComplete)
+			return (np.zeros(frame_count).astype(np.float32), paComplete)
 
-		buf = self.buffers[self.queue.get()]
-		return (buf, pyaudio.paContinue)
+		queueDepth = self.ring.qsize()
+		self.stats.recordCallback(status, queueDepth, queueDepth * frame_count / self.fs)
+		if self.tuner is not None:
+			self.tuner.update(self.stats, self.ring)
+		return (buf, paContinue)
 
 	def generate(self):
-		buf = self.buffers[self.buf_idx]
+		ring = self.ring
+		buf = ring.acquire(timeout=0.1)
+		if buf is None:
+			return
+
+		start = time.perf_counter()
+		self.render(buf)
+		self.stats.recordGeneration(time.perf_counter() - start)
+		ring.commit()
+
+	def render(self, buf):
+		self.runCommands()
+
+		# split at the scheduled pulse events, so that they happen on their exact sample
+		n = 0
+		while n < len(buf):
+			self.runPulseEvents()
+			count = len(buf) - n
+			if self.pulseEvents:
+				count = min(count, self.pulseEvents[0][0] - self.sampleClock)
+			self.renderBlock(buf[n:n+count])
+			self.sampleClock+=count
+			n+=count
+
+	def runCommands(self):
+		while self.commands:
+			method, args, kwargs = self.commands.popleft()
+			method(self, *args, **kwargs)
+
+	def runPulseEvents(self):
+		if self.pulseScheduleChanged:
+			self.pulseScheduleChanged = False
+			starts = [sample for sample, event in self.pulseEvents if event == self.PULSE_ON]
+			interval = self.pulseInterval()
+			if not interval or not starts or min(starts) - self.sampleClock > 2 * interval:
+				self.pulseEvents = [e for e in self.pulseEvents if e[1] != self.PULSE_ON]
+				heapq.heapify(self.pulseEvents)
+				if interval:
+					# the first pulse starts right away, or one interval later when a long one was waiting
+					heapq.heappush(self.pulseEvents, (self.sampleClock + (interval if starts else 0), self.PULSE_ON))
+				elif starts and not self.manualPulse:
+					self.setActive(False) # repetition stopped
+
+		while self.pulseEvents and self.pulseEvents[0][0] <= self.sampleClock:
+			sample, event = heapq.heappop(self.pulseEvents)
+			if event == self.PULSE_ON:
+				# the end of the previous pulse, if still to come, is replaced by this one's
+				self.pulseEvents = [e for e in self.pulseEvents if e[1] != self.PULSE_OFF]
+				heapq.heapify(self.pulseEvents)
+				heapq.heappush(self.pulseEvents, (sample + self.pulseInterval(), self.PULSE_ON))
+				heapq.heappush(self.pulseEvents, (sample + int(round(self.pulseDuration * self.fs)), self.PULSE_OFF))
+				if not self.manualPulse:
+					self.setActive(False)
+					self.setActive(True)
+			elif not self.manualPulse:
+				self.setActive(False)
+
+	def pulseInterval(self):
+		if self.pulseRate <= 0:
+			return 0
+		return max(1, int(round(60.0 * self.fs / self.pulseRate)))
+
+	def renderBlock(self, buf):
+		if self.pulseStarting:
+			self.startTemplate()
+		template = self.template
+		count = self.playTemplate(template, buf) if template is not None else 0
+		if count < len(buf):
+			self.synthesize(buf[count:])
+			self.recordTemplate(buf[count:])
+
+	def templateState(self):
+		return tuple(getattr(self, name) for name in self.TEMPLATE_STATE)
+
+	def startTemplate(self):
+		self.pulseStarting = False
+		if not self.templatesEnabled or self.periodMode != self.VARFREQ_PERIOD or self.frequency != self.baseFrequency or self.currentVolumeFactor != 0 or self.currentTimeInCycle != 0 or abs(self.volume) > self.TEMPLATE_SILENCE:
+			return
+
+		# same start for the pulses of a template
+		phaseIndex = int(round(self.phase * self.TEMPLATE_PHASES / TURN)) % self.TEMPLATE_PHASES
+		self.phase = phaseIndex * TURN // self.TEMPLATE_PHASES
+		self.volume = 0.0
+		key = (self.fs, self.baseFrequency, self.frequencyRaiseRate, self.constantFrequencyDuration, self.volumeRaiseRate, self.maxVolume, self.waveFormType, phaseIndex)
+		if key in self.templates:
+			self.templates.move_to_end(key)
+		else:
+			self.templates[key] = PulseTemplate(self.templateState())
+			if len(self.templates) > self.TEMPLATES_NBR:
+				self.templates.popitem(last=False)
+		self.template = self.templates[key]
+		self.templatePosition = 0
+
+	def playTemplate(self, template, buf):
+		# copies the recorded samples, with the engine state of the last buffer end they were rendered with:
+		# templateLag samples behind, caught up with leaveTemplate()
+		count = min(len(buf), template.length - self.templatePosition)
+		if count <= 0:
+			return 0
+		buf[:count] = template.samples[self.templatePosition:self.templatePosition+count]
+		self.templatePosition+=count
+		index = bisect.bisect_right(template.positions, self.templatePosition) - 1
+		for name, value in zip(self.TEMPLATE_STATE, template.states[index]):
+			setattr(self, name, value)
+		self.templateLag = self.templatePosition - template.positions[index]
+		return count
+
+	def leaveTemplate(self):
+		template, self.template = self.template, None
+		if template is not None and self.templateLag > 0:
+			self.synthesize(np.empty(self.templateLag, dtype=np.float32))
+		self.templateLag = 0
+
+	def recordTemplate(self, buf):
+		# extends the template at its end, leaves it anywhere else
+		template = self.template
+		if template is None:
+			return
+		if self.templatePosition == template.length and template.length + len(buf) <= self.TEMPLATE_MAX_SECONDS * self.fs:
+			template.append(buf, self.templateState())
+			self.templatePosition = template.length
+		else:
+			self.template = None
 
-		# [currentVolumeFactor * maxVolume] ---> [newVolume] ---lpf---> [volume]
-		for n in range(self.frames_per_buffer):
-			if self.periodMode == self.REST_PERIOD:
-				self.deltaPhase = 2*np.pi*self.baseFrequency/self.fs
-				self.newVolume = 0
-			else:
-				# advance "time"
-				self.currentTimeInCycle+= self.deltaTime
-
-				# compute volume
-				self.currentVolumeFactor+=self.volumeRaiseDelta
-				if self.currentVolumeFactor > 1:
-					self.currentVolumeFactor = 1
-
-				self.newVolume = self.maxVolume * self.currentVolumeFactor
-
-				if self.periodMode == self.VARFREQ_PERIOD:
-					# compute frequency shift and signal phase
-					self.frequency+=self.frequencyRaiseDelta
-					if self.frequency > self.baseFrequency * 2:
-						self.frequency = self.baseFrequency
-						self.periodMode = self.CSTFREQ_PERIOD
-						self.currentTimeInCycle = 0
-					self.deltaPhase = 2*np.pi*self.frequency/self.fs
-
-				else: # self.CSTFREQ_PERIOD:
-					self.deltaPhase = 2*np.pi*self.frequency/self.fs
-					if self.currentTimeInCycle > self.constantFrequencyDuration:
-						self.periodMode = self.VARFREQ_PERIOD
-						self.frequency = self.baseFrequency
-						self.currentTimeInCycle = 0
-
-			# update phase for each sample
-			self.phase+=self.deltaPhase
-			if self.phase > 2*np.pi:
-				self.phase-=2*np.pi
-
-			# make signal...
-			if self.waveFormType == self.SINE:
-				# simple sinewave
-				buf[n] = self.volume * np.sin(self.phase)
-
-			elif self.waveFormType == self.SINE2:
-				# squared and alternated sinewave
-				buf[n] = self.volume * np.sin(self.phase)**2 * (1 if self.phase > np.pi else -1)
-
-			elif self.waveFormType == self.SINE3:
-				# cubed sinewave
-				buf[n] = self.volume * np.sin(self.phase)**3
-
-			elif self.waveFormType == self.TRIANGLE:
-				# triangle waveform
-				if self.phase <= 0.5*np.pi:
-					buf[n] = self.volume * (self.phase/(0.5*np.pi))
-				elif self.phase <= np.pi*1.5:
-					buf[n] = self.volume * (2-(self.phase/(0.5*np.pi)))
-				else:
-					buf[n] = self.volume * (-4+(self.phase/(0.5*np.pi)))
+	def synthesize(self, buf):
+		frames = len(buf)
+		deltaPhase = np.empty(frames, dtype=PHASE_TYPE) # DDS tuning words
+		newVolume = np.empty(frames)
 
+		# [currentVolumeFactor * maxVolume] ---> [newVolume] ---lpf---> [volume]
+		n = 0
+		while n < frames:
+			n+=self.renderSegment(deltaPhase[n:], newVolume[n:])
+
+		# update phase for each sample
+		phase = PHASE_TYPE(self.phase) + np.cumsum(deltaPhase, dtype=PHASE_TYPE)
+		self.phase = int(phase[-1])
+
+		# make signal...
+		buf[:] = self.lowPassVolume(newVolume) * self.waveform(phase, wordFrequency(deltaPhase.max(), self.fs))
+
+	def renderSegment(self, deltaPhase, newVolume):
+		# fills samples until the next period mode transition, returns their count
+		frames = len(deltaPhase)
+		if self.periodMode == self.REST_PERIOD:
+			deltaPhase[:] = tuningWord(self.baseFrequency, self.fs)
+			newVolume[:] = 0
+			return frames
+
+		# advance "time"
+		currentTimeInCycle = self.ramp(self.currentTimeInCycle, self.deltaTime, frames)
+
+		if self.periodMode == self.VARFREQ_PERIOD:
+			# compute frequency shift, until it goes over twice the base frequency
+			frequency = self.ramp(self.frequency, self.frequencyRaiseDelta, frames)
+			transition = frequency > self.baseFrequency * 2
+		else: # self.CSTFREQ_PERIOD:
+			frequency = np.full(frames, float(self.frequency))
+			transition = currentTimeInCycle > self.constantFrequencyDuration
+
+		count = frames
+		if transition.any():
+			count = int(np.argmax(transition)) + 1
+			if self.periodMode == self.VARFREQ_PERIOD:
+				frequency[count-1] = self.baseFrequency
+				self.periodMode = self.CSTFREQ_PERIOD
 			else:
-				buf[n] = 0
-
-			# IIR low pass filter for volume control
-			if self.newVolume != None:
-				self.volume, self.oldVolume = self.volume * 0.998 + self.newVolume * 0.002, self.volume
-				if self.volume == self.oldVolume:
-					self.volume, self.newVolume = self.newVolume, None
-
-		# ~ print("#" * int((time.time() - start)*1000))
-		self.queue.put(self.buf_idx)
-		self.buf_idx+=1
-		if self.buf_idx >= len(self.buffers):
-			self.buf_idx = 0
+				self.periodMode = self.VARFREQ_PERIOD
+			self.frequency = self.baseFrequency
+			self.currentTimeInCycle = 0
+		else:
+			self.frequency = frequency[-1]
+			self.currentTimeInCycle = currentTimeInCycle[-1]
+
+		deltaPhase[:count] = tuningWords(frequency[:count], self.fs)
+
+		# compute volume
+		currentVolumeFactor = np.minimum(self.ramp(self.currentVolumeFactor, self.volumeRaiseDelta, count), 1)
+		self.currentVolumeFactor = currentVolumeFactor[-1]
+		newVolume[:count] = self.maxVolume * currentVolumeFactor
+		return count
+
+	def ramp(self, start, delta, frames):
+		# summed sequentially by cumsum, as the sample by sample code would do
+		values = np.full(frames+1, float(delta))
+		values[0] = start
+		return np.cumsum(values)[1:]
+
+	def lowPassVolume(self, newVolume):
+		# IIR low pass filter for volume control, in closed form over small chunks
+		volume = np.empty(len(newVolume))
+		chunk = len(self.volumeDecay)
+		for start in range(0, len(newVolume), chunk):
+			nv = newVolume[start:start+chunk]
+			decay = self.volumeDecay[:len(nv)]
+			v = decay * (self.volume + 0.002 * np.cumsum(nv / decay))
+			volume[start] = self.volume
+			volume[start+1:start+len(nv)] = v[:-1]
+			self.volume = v[-1]
+
+		self.newVolume = newVolume[-1]
+		if abs(self.volume - self.newVolume) < 1e-12:
+			self.volume = self.newVolume
+		return volume
+
+	def waveform(self, phase, frequency):
+		# band limited, from the tables of the waveform, with the harmonics of the highest frequency in the buffer under fs/2
+		if 0 <= self.waveFormType < len(WAVEFORMS):
+			return getWavetable(WAVEFORMS[self.waveFormType], self.wavetableCacheDir).render(phase, frequency, self.fs)
+		return np.zeros(len(phase))
 
 	def __del__(self):
-		self.p.terminate()
+		self.backend.terminate()
 
 	def isStreamActive(self):
 		if self.stream == None:
 			return False
 		return self.stream.is_active()
 
+	@forwarded
+	@onProducerThread
 	def setFrequency(self, baseFrequency):
+		self.leaveTemplate()
 		self.baseFrequency = baseFrequency
 		if self.frequencyRaiseRate == 0:
 			self.frequency = self.baseFrequency
 		self.frequencyRaiseDelta = self.baseFrequency*self.frequencyRaiseRate/self.fs
 
+	@forwarded
+	@onProducerThread
 	def setFrequencyRaiseRate(self, frequencyRaiseRate):
+		self.leaveTemplate()
 		self.frequencyRaiseRate = frequencyRaiseRate
 		self.frequencyRaiseDelta = self.baseFrequency*self.frequencyRaiseRate/self.fs
 
+	@forwarded
+	@onProducerThread
 	def setVolume(self, volume):
+		self.leaveTemplate()
 		self.maxVolume = volume
 
+	@forwarded
+	@onProducerThread
 	def setVolumeRaiseRate(self, volumeRaiseRate):
+		self.leaveTemplate()
 		self.volumeRaiseRate = volumeRaiseRate
 		self.volumeRaiseDelta = self.volumeRaiseRate/self.fs
 
+	@forwarded
+	@onProducerThread
 	def setConstantFrequencyDuration(self, duration=None, frequency=None):
+		self.leaveTemplate()
 		if duration:
 			self.constantFrequencyDuration = duration
 		elif frequency:
 			self.constantFrequencyDuration = 1.0/frequency
 
+	@forwarded
+	@onProducerThread
 	def setWaveFormType(self, waveFormType):
+		self.leaveTemplate()
 		self.waveFormType = waveFormType
 
+	@forwarded
+	@onProducerThread
+	def setPulseRate(self, rate):
+		# pulses repetition in min^-1, 0 to stop it
+		self.pulseRate = rate
+		self.pulseScheduleChanged = True
+
+	@forwarded
+	@onProducerThread
+	def setPulseDuration(self, duration):
+		# of the pulses starting from now on, in seconds
+		self.pulseDuration = duration
+
+	@forwarded
+	@onProducerThread
+	def setManualPulse(self, on):
+		self.manualPulse = on
+
+	@forwarded
+	@onProducerThread
 	def setActive(self, on=False):
+		self.leaveTemplate()
+		self.pulseStarting = on
 		if on:
 			self.periodMode = self.VARFREQ_PERIOD
 			self.frequency = self.baseFrequency
@@ -354,14 +614,19 @@ class FrequencyPicker(QHBoxLayout):
 
 
 class GUI(QWidget):
-	def __init__(self):
+	def __init__(self, backend=None, framesPerBuffer=1000, buffers=3, process=False, tuner=None):
 		QWidget.__init__(self)
+		self.framesPerBuffer = framesPerBuffer
+		self.buffers = buffers
 		self.initUI()
-		self.sound = PulsingSoundGenerator()
+		self.sound = PulsingSoundGenerator(backend=backend, process=process)
+		self.sound.tuner = tuner
 		self.sound.setFrequency(50)
 		self.sound.error.connect(self.soundError)
 		self.frequencyPicker.setValue(self.sound.baseFrequency)
 		self.frequencyPickerChanged(self.sound.baseFrequency)
+		if tuner is not None:
+			tuner.calibrateInBackground(self.sound.calibrationEngine().render, self.sound.fs, self.sound.backend)
 
 	def enableSoundCardBtnClicked(self):
 		if self.enableSoundCardBtn.isChecked():
@@ -369,8 +634,10 @@ class GUI(QWidget):
 			self.sound.setVolumeRaiseRate(self.volumeRaiseRateSlider.value())
 			self.sound.setFrequencyRaiseRate(self.frequencyRaiseRate.value())
 			self.sound.setConstantFrequencyDuration(frequency=self.constantFrequencyDurationInverse.value())
+			self.sound.setPulseDuration(self.pulseDuration.value())
+			self.sound.setPulseRate(self.pulseRepetitionRate.value())
 			self.refreshIndicatorsTimer.start(40)
-			self.sound.start()
+			self.sound.start(frames_per_buffer=self.framesPerBuffer, buffers=self.buffers)
 		else:
 			self.enableSoundCardBtn.setEnabled(False)
 			self.sound.setVolume(0)
@@ -398,6 +665,7 @@ class GUI(QWidget):
 			QProgressBar { text-align: center; border: 1px solid grey; border-radius: 2px; } \
 			QProgressBar#frequency::chunk { background-color: #00d0d0; } \
 			QProgressBar#power::chunk { background-color: red; } \
+			QLabel#stats { font-size: 8pt; color: grey; } \
 		");
 		"""
 			#QSlider::groove:horizontal { border: 1px solid #999999; height: 10px; } \
@@ -509,11 +777,10 @@ class GUI(QWidget):
 
 		self.manualPulseBtn = mkButton("Manual Pulse", layout2)
 		def manualPulseBtnEvent(state):
-			self.manualPulseBtn.isCurrentlyPressedOn = state
+			self.sound.setManualPulse(state)
 			self.sound.setActive(state)
 		self.manualPulseBtn.pressed.connect(lambda: manualPulseBtnEvent(True))
 		self.manualPulseBtn.released.connect(lambda: manualPulseBtnEvent(False))
-		self.manualPulseBtn.isCurrentlyPressedOn = False
 
 		mkLabel("Global Speed", layout)
 		def globalRateValueChanged():
@@ -530,6 +797,12 @@ class GUI(QWidget):
 
 		self.enableSoundCardBtn = mkButton("&Enable soundcard", layout, self.enableSoundCardBtnClicked, isCheckable=True)
 
+		self.statsLabel = mkLabel(layout=layout, objectName="stats")
+		self.statsLabel.setWordWrap(True)
+		self.statsTimer = QTimer()
+		self.statsTimer.timeout.connect(lambda: self.statsLabel.setText(self.sound.stats.summary()))
+		self.statsTimer.start(1000)
+
 		self.setWindowTitle("Generator")
 		self.setWindowIcon(getEmbeddedIcon())
 		self.show()
@@ -538,60 +811,23 @@ class GUI(QWidget):
 		self.refreshIndicatorsTimer = QTimer()
 		self.refreshIndicatorsTimer.timeout.connect(self.refreshIndicators)
 
-		self.triggerPulseTimer = QTimer()
-		self.triggerPulseTimer.timeout.connect(self.startPulseTimerTimeout)
-		self.stopPulseTimer = QTimer()
-		self.stopPulseTimer.setSingleShot(True)
-		self.stopPulseTimer.timeout.connect(self.stopPulseTimerTimeout)
-
 	def pulseRepetitionRateUpdate(self):
+		# pulses are scheduled by the sound engine, on its samples clock
 		rate = self.pulseRepetitionRate.value() # in pulses per minutes
-		if rate == 0:
-			self.triggerPulseTimer.stop()
-			if not self.manualPulseBtn.isCurrentlyPressedOn:
-				self.sound.setActive(False)
-		else:
-			interval_ms = int(round(60000.0 / rate))
-			self.pulseRepetitionRate.valueBkp = interval_ms
-
-			try:
-				remaining_ms = self.triggerPulseTimer.remainingTime()
-			except: # remainingTime() is not available on Qt4
-				remaining_ms = -1
-
-			if remaining_ms == -1:
-				self.triggerPulseTimer.start(interval_ms)
-			elif remaining_ms > 2 * interval_ms:
-				self.triggerPulseTimer.setInterval(interval_ms)
-
-			interval_s = interval_ms / 1000.0
+		self.sound.setPulseRate(rate)
+		if rate != 0:
+			interval_s = 60.0 / rate
 			if interval_s < self.pulseDuration.value():
 				self.pulseDuration.setValue(interval_s)
 
 	def pulseDurationUpdate(self):
 		duration_s = self.pulseDuration.value() # seconds
+		self.sound.setPulseDuration(duration_s)
 		if duration_s > 0:
 			maxRepetitionRate = 60.0 / duration_s
 			if self.pulseRepetitionRate.value() > maxRepetitionRate:
 				self.pulseRepetitionRate.setValue(maxRepetitionRate)
 
-	def startPulseTimerTimeout(self):
-		# update pulse repetition timer interval
-		interval_ms = self.pulseRepetitionRate.valueBkp
-		self.triggerPulseTimer.setInterval(interval_ms)
-
-		duration_ms = int(self.pulseDuration.value() * 1000)
-		self.stopPulseTimer.start(duration_ms)
-
-		if not self.manualPulseBtn.isCurrentlyPressedOn:
-			if self.sound.periodMode:
-				self.sound.setActive(False)
-			self.sound.setActive(True)
-
-	def stopPulseTimerTimeout(self):
-		if not self.manualPulseBtn.isCurrentlyPressedOn:
-			self.sound.setActive(False)
-
 	def refreshIndicators(self):
 		if self.sound.periodMode:
 			self.frequencyIndicator.setFormat("%.1f Hz" % self.sound.frequency)
@@ -618,9 +854,67 @@ class GUI(QWidget):
 		self.sound.setFrequency(frequency)
 
 
+WAVEFORMS = ['sine', 'sine2', 'sine3', 'triangle']
+
+def renderOffline(args):
+	sound = PulsingSoundGenerator(fs=args.fs, threaded=False)
+	sound.wavetableCacheDir = args.wavetable_cache
+	sound.setFrequency(args.frequency)
+	sound.setFrequencyRaiseRate(args.frequency_raise_rate)
+	sound.setConstantFrequencyDuration(frequency=args.constant_frequency_rate)
+	sound.setVolume(args.volume)
+	sound.setVolumeRaiseRate(args.volume_raise_rate)
+	sound.setWaveFormType(WAVEFORMS.index(args.waveform))
+	sound.reset()
+
+	# repeated pulses scheduled by the engine, or a single endless one
+	sound.setPulseDuration(args.pulse_duration)
+	sound.setPulseRate(args.pulse_rate)
+	if not args.pulse_rate:
+		sound.setActive(True)
+
+	buf = np.zeros(1000).astype(np.float32)
+	frames = int(round(args.duration * sound.fs))
+	with PcmWriter(args.render, sound.fs, args.format, args.raw) as writer:
+		while frames > 0:
+			count = min(frames, len(buf))
+			sound.render(buf[:count])
+			writer.write(buf[:count])
+			frames-=count
+
 def main():
-	app = QApplication(sys.argv)
-	gui = GUI()
+	parser = argparse.ArgumentParser(description="Pulse generator. Opens the GUI, unless --render is given.")
+	parser.add_argument('--render', metavar='FILE', help="render offline as fast as possible to a WAV file ('-' for stdout)")
+	parser.add_argument('--raw', action='store_true', help="write raw PCM samples instead of WAV")
+	parser.add_argument('--format', choices=PcmWriter.FORMATS, default='float32', help="sample format (default: %(default)s)")
+	parser.add_argument('--fs', type=int, default=22050, help="sampling rate in Hz (default: %(default)s)")
+	parser.add_argument('--duration', type=float, default=10, help="duration in seconds (default: %(default)s)")
+	parser.add_argument('--frequency', type=float, default=50, help="base frequency in Hz (default: %(default)s)")
+	parser.add_argument('--frequency-raise-rate', type=float, default=4, help="frequency raise rate factor in Hz/s (default: %(default)s)")
+	parser.add_argument('--constant-frequency-rate', type=float, default=4, help="constant frequency period inverse duration in s^-1 (default: %(default)s)")
+	parser.add_argument('--volume', type=float, default=0.5, help="maximum amplitude, from 0 to 1 (default: %(default)s)")
+	parser.add_argument('--volume-raise-rate', type=float, default=1, help="amplitude raise rate in s^-1 (default: %(default)s)")
+	parser.add_argument('--waveform', choices=WAVEFORMS, default='sine', help="waveform (default: %(default)s)")
+	parser.add_argument('--pulse-rate', type=float, default=0, help="pulse repetition rate in min^-1, 0 for a single endless pulse (default: %(default)s)")
+	parser.add_argument('--pulse-duration', type=float, default=1, help="pulse duration in seconds (default: %(default)s)")
+	parser.add_argument('--wavetable-cache', metavar='DIR', help="keep the band limited wavetables in this directory, not to compute them again")
+	addStreamArguments(parser)
+	addBackendArguments(parser)
+	addTunerArguments(parser)
+	args, qtArgs = parser.parse_known_args()
+
+	if args.render:
+		renderOffline(args)
+		return
+
+	app = QApplication(sys.argv[:1] + qtArgs)
+	gui = GUI(backend=makeBackend(args.backend, args.speed), framesPerBuffer=args.frames_per_buffer, buffers=args.buffers, process=args.process, tuner=makeTuner(args))
+	if args.stats_log:
+		# printed from the event loop, away from the audio callback
+		logTimer = QTimer()
+		logTimer.timeout.connect(gui.sound.stats.log)
+		logTimer.start(int(args.stats_log * 1000))
+	gui.sound.wavetableCacheDir = args.wavetable_cache
 	app.installEventFilter(gui)
 	ret = app.exec_()
 	sys.exit(ret)
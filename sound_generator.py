@@ -1,8 +1,43 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sys, os, time
-import numpy as np, pyaudio
+import sys, os, time, argparse, threading, fractions
+import numpy as np
+
+from pcm_writer import PcmWriter
+from audio_backends import PortAudioBackend, makeBackend, addBackendArguments, paContinue
+from stream_stats import StreamStats
+from process_worker import forwarded, cloneEngine
+from audio_stream import startStream, addStreamArguments
+from latency_tuner import addTunerArguments, makeTuner
+from wavetable import getWavetable, tuningWord, phaseRamp, phaseAdvance, TURN, PHASE_TYPE
+
+class SteadyLoop():
+	# whole number of periods of a steady tone from phase on, built a slice at a time, samples None if
+	# there is no loop short enough. version is the one of the parameters it was started with.
+	def __init__(self, version, phase, volume, deltaPhase, maxLength, drift, frames):
+		self.version = version
+		self.phase = phase
+		self.volume = volume
+		# fewest samples holding a whole number of periods, from the best rational approximation of the frequency
+		cycles = fractions.Fraction(deltaPhase, TURN)
+		ratio = cycles.limit_denominator(maxLength)
+		self.length = ratio.denominator
+		self.cycles = ratio.numerator
+		# one buffer more than the loop, so that any buffer is a single slice of it
+		self.samples = np.zeros(self.length + frames, dtype=np.float32) if abs(ratio - cycles) <= drift * cycles else None
+		self.built = 0
+		self.elapsed = 0 # samples synthesized from phase on, while it was built
+
+	def complete(self):
+		return self.samples is not None and self.built == len(self.samples)
+
+	def build(self, waveform, count):
+		n = np.arange(self.built, min(len(self.samples), self.built + count), dtype=np.int64)
+		turns = (n * self.cycles % self.length) / self.length
+		phase = PHASE_TYPE(self.phase) + (np.rint(turns * TURN).astype(np.int64) % TURN).astype(PHASE_TYPE)
+		self.samples[self.built:self.built+len(n)] = self.volume * waveform(phase)
+		self.built+=len(n)
 
 class SoundGenerator():
 	SINE = 0
@@ -10,104 +45,192 @@ class SoundGenerator():
 	SINE3 = 2
 	TRIANGLE = 3
 	SQUARE = 4
-
-	def __init__(self, fs=44100):
+	# mirrored from the synthesis process
+	PROCESS_STATUS = ['phase', 'volume']
+	# steady tones are replayed from a loop of a whole number of periods, at most LOOP_MAX_SECONDS long,
+	# played at most LOOP_DRIFT (relative) off the requested frequency
+	LOOP_MAX_SECONDS = 1.0
+	LOOP_DRIFT = 1e-6
+	# not while a slider is dragged: started once the parameters did not change for LOOP_STABLE_BUFFERS
+	# buffers, and built LOOP_BUILD_BUFFERS buffers at a time while the tone is still synthesized
+	LOOP_STABLE_BUFFERS = 4
+	LOOP_BUILD_BUFFERS = 8
+
+	def __init__(self, fs=44100, backend=None, process=False):
 		self.newFrequency = None
 		self.newVolume = 0
 		self.fs = float(fs)
 		self.waveFormType = self.SINE
+		self.wavetableCacheDir = None
 		self.volume = 0.3
 		self.frequency = 0
-		self.deltaPhase = 0
+		self.deltaPhase = 0 # DDS tuning word
+		self.phase = 0 # DDS phase accumulator
+		self.sampleIndex = None
 		self.stream = None
-		self.p = pyaudio.PyAudio()
-		self.output_device_index = -1
-
-		for i in range(self.p.get_device_count()):
-			name = self.p.get_device_info_by_index(i)['name']
-			if 'pipewire' in name:
-				self.output_device_index = i
-			print("%2d %s%s" % (i, "*" if self.output_device_index == i else "", name))
-
-	def start(self, fs=None):
+		self.backend = backend if backend is not None else PortAudioBackend()
+		self.stats = StreamStats()
+		self.ring = None
+		self.running = False
+		self.thread = None
+		self.useProcess = process
+		self.worker = None
+		self.tuner = None
+		self.loopEnabled = True
+		self.loop = None
+		self.loopPosition = 0
+		# incremented by the setters, a loop is only played if it was built from the current parameters
+		self.loopVersion = 0
+		self.loopStableVersion = 0
+		self.loopStableBuffers = 0
+
+	def start(self, fs=None, frames_per_buffer=1000, buffers=3):
 		if self.stream == None:
 			if fs != None:
 				self.fs = float(fs)
-			self.outbuf = np.zeros(1000).astype(np.float32)
-			self.bufferPreRoll = 10
+			if self.tuner is not None:
+				frames_per_buffer, buffers = self.tuner.calibrate(self.calibrationEngine().render, self.fs, self.backend)
+			self.silence = np.zeros(frames_per_buffer).astype(np.float32)
 			self.phase = 0
-			self.stream = self.p.open(format=pyaudio.paFloat32, channels=1, rate=int(self.fs), output=True, output_device_index=self.output_device_index, stream_callback=self.callback, frames_per_buffer=1000)
-			self.stream.start_stream()
+			self.loop = None
+			self.stats.reset()
+
+			startStream(self, frames_per_buffer, buffers, self.startFillingThread)
+
+	def calibrationEngine(self):
+		# with our settings, rendering without touching our state
+		return cloneEngine(self)
+
+	def startFillingThread(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.fillingBufferWorker)
+		self.thread.start()
 
 	def callback(self, in_data, frame_count, time_info, status):
-		if self.bufferPreRoll:
-			self.bufferPreRoll-=1
-			return (self.outbuf, pyaudio.paContinue)
-
-		for n in range(frame_count):
-			if self.waveFormType == self.SINE:
-				# simple sinewave
-				self.outbuf[n] = self.volume * np.sin(self.phase)
-
-			elif self.waveFormType == self.SINE2:
-				# squared and alternated sinewave
-				self.outbuf[n] = self.volume * np.sin(self.phase)**2 * (1 if self.phase > np.pi else -1)
-
-			elif self.waveFormType == self.SINE3:
-				# cubed sinewave
-				self.outbuf[n] = self.volume * np.sin(self.phase)**3
-
-			elif self.waveFormType == self.TRIANGLE:
-				# triangle waveform
-				if self.phase <= 0.5*np.pi:
-					self.outbuf[n] = self.volume * (self.phase/(0.5*np.pi))
-				elif self.phase <= np.pi*1.5:
-					self.outbuf[n] = self.volume * (2-(self.phase/(0.5*np.pi)))
-				else:
-					self.outbuf[n] = self.volume * (-4+(self.phase/(0.5*np.pi)))
-
-			elif self.waveFormType == self.SQUARE:
-				# square wave
-				self.outbuf[n] = self.volume * (-1 if self.phase<np.pi else 1)
-
-			# update phase for each sample
-			self.phase+=self.deltaPhase
-			if self.phase > 2*np.pi:
-				self.phase-=2*np.pi
-
-			# low pass filter for volume control
-			if self.newVolume != None:
-				self.volume, self.oldVolume = self.volume * 0.999 + self.newVolume * 0.001, self.volume
-				if self.volume == self.oldVolume:
-					self.volume, self.newVolume = self.newVolume, None
-
-		return (self.outbuf, pyaudio.paContinue)
+		buf = self.ring.pop()
+		if buf is None:
+			self.stats.recordUnderrun()
+			if len(self.silence) != frame_count:
+				self.silence = np.zeros(frame_count).astype(np.float32)
+			buf = self.silence
+
+		queueDepth = self.ring.qsize()
+		self.stats.recordCallback(status, queueDepth, queueDepth * frame_count / self.fs)
+		if self.tuner is not None:
+			self.tuner.update(self.stats, self.ring)
+		return (buf, paContinue)
+
+	def fillingBufferWorker(self):
+		ring = self.ring
+		while self.running:
+			buf = ring.acquire(timeout=0.1)
+			if buf is None:
+				continue
+
+			start = time.perf_counter()
+			self.render(buf)
+			self.stats.recordGeneration(time.perf_counter() - start)
+			ring.commit()
+
+	def render(self, buf):
+		frames = len(buf)
+		if self.loopEnabled and self.newVolume is None and self.playLoop(buf):
+			return
+
+		if self.sampleIndex is None or len(self.sampleIndex) != frames:
+			self.sampleIndex = np.arange(frames)
+			self.volumeDecay = 0.999**self.sampleIndex
+
+		# phase ramp for the whole buffer, carried over from the previous one
+		phase = phaseRamp(self.phase, self.deltaPhase, frames)
+		self.phase = phaseAdvance(self.phase, self.deltaPhase, frames)
+
+		# low pass filter for volume control, in closed form
+		if self.newVolume != None:
+			volume = self.newVolume + (self.volume - self.newVolume) * self.volumeDecay
+			self.volume = self.newVolume + (self.volume - self.newVolume) * 0.999**frames
+			if abs(self.volume - self.newVolume) < 1e-7:
+				self.volume, self.newVolume = self.newVolume, None
+		else:
+			volume = self.volume
+
+		buf[:] = volume * self.waveform(phase)
+
+	def playLoop(self, buf):
+		# True if buf was played from the loop of the current parameters
+		frames = len(buf)
+		version = self.loopVersion
+		loop = self.loop
+		if loop is None or loop.version != version or (loop.complete() and len(loop.samples) < loop.length + frames):
+			if version != self.loopStableVersion:
+				self.loopStableVersion = version
+				self.loopStableBuffers = 0
+			self.loopStableBuffers+=1
+			if self.loopStableBuffers <= self.LOOP_STABLE_BUFFERS:
+				return False
+			# a setter called from here on changes the version, and this loop is not played
+			loop = self.loop = SteadyLoop(version, self.phase, self.volume, self.deltaPhase, max(1, int(self.LOOP_MAX_SECONDS * self.fs)), self.LOOP_DRIFT, frames)
+		if loop.samples is None:
+			return False # no loop short enough, keep synthesizing
+
+		if not loop.complete():
+			loop.build(self.waveform, self.LOOP_BUILD_BUFFERS * frames)
+			if not loop.complete():
+				# this buffer is synthesized
+				loop.elapsed+=frames
+				return False
+			self.loopPosition = loop.elapsed % loop.length
+		if loop.version != self.loopVersion:
+			return False
+
+		buf[:] = loop.samples[self.loopPosition:self.loopPosition+frames]
+		self.loopPosition = (self.loopPosition + frames) % loop.length
+		self.phase = (loop.phase + (self.loopPosition * loop.cycles % loop.length * TURN + loop.length // 2) // loop.length) % TURN
+		return True
+
+	def waveform(self, phase):
+		# band limited, from the tables of the waveform
+		if 0 <= self.waveFormType < len(WAVEFORMS):
+			return getWavetable(WAVEFORMS[self.waveFormType], self.wavetableCacheDir).render(phase, self.frequency, self.fs)
+		return np.zeros(len(phase))
 
 	def stop(self):
 		if self.stream != None:
 			self.stream.stop_stream()
 			self.stream.close()
 			self.stream = None
+			if self.worker is not None:
+				self.worker.stop()
+				self.worker = None
+			else:
+				self.running = False
+				self.thread.join()
 
 	def __del__(self):
-		self.p.terminate()
+		self.backend.terminate()
 
 	def isActive(self):
 		if self.stream == None:
 			return False
 		return self.stream.is_active()
 
+	@forwarded
 	def setFrequency(self, frequency):
 		self.frequency = frequency
-		self.deltaPhase = 2*np.pi*self.frequency/self.fs
+		self.deltaPhase = tuningWord(self.frequency, self.fs)
+		self.loopVersion+=1
 
+	@forwarded
 	def setVolume(self, volume):
 		self.newVolume = volume
 		if not self.isActive():
 			self.volume = volume
+		self.loopVersion+=1
 
+	@forwarded
 	def setWaveFormType(self, waveFormType):
 		self.waveFormType = waveFormType
+		self.loopVersion+=1
 
 try:
 	# sudo apt-get install python3-pyqt5
@@ -116,13 +239,13 @@ try:
 	from PyQt5.QtCore import *
 	from PyQt5.QtWidgets import *
 	PYQT_VERSION = 5
-	print("Using PyQt5")
+	print("Using PyQt5", file=sys.stderr)
 except:
 	# sudo apt-get install python-qtpy python3-qtpy
 	from PyQt4.QtGui import *
 	from PyQt4.QtCore import *
 	PYQT_VERSION = 4
-	print("Using PyQt4")
+	print("Using PyQt4", file=sys.stderr)
 
 class FrequencyPicker(QHBoxLayout):
 	def __init__(self, unit="Hz", digitsNumber=6, decimals=2):
@@ -216,16 +339,21 @@ class FrequencyPicker(QHBoxLayout):
 		self.updateGreyness()
 
 class GUI(QWidget):
-	def __init__(self):
+	def __init__(self, backend=None, framesPerBuffer=1000, buffers=3, process=False, tuner=None):
 		super(GUI, self).__init__()
+		self.framesPerBuffer = framesPerBuffer
+		self.buffers = buffers
 		self.initUI()
-		self.sound = SoundGenerator()
+		self.sound = SoundGenerator(backend=backend, process=process)
+		self.sound.tuner = tuner
 		self.setFrequency(100, updateFrequencyPicker=True)
+		if tuner is not None:
+			tuner.calibrateInBackground(self.sound.calibrationEngine().render, self.sound.fs, self.sound.backend)
 
 	def enableSoundCardBtnClicked(self):
 		if self.enableSoundCardBtn.isChecked():
 			self.sound.setVolume(self.v.value() / 100.0)
-			self.sound.start()
+			self.sound.start(frames_per_buffer=self.framesPerBuffer, buffers=self.buffers)
 		else:
 			self.sound.setVolume(0)
 			self.soundOffTimer = QTimer()
@@ -246,6 +374,7 @@ class GUI(QWidget):
 			QSplitter::handle:horizontal { width:  2px; image: none; } \
 			QLabel#digit { font-size: 40pt; padding-left: 0px; padding-right: 0px; } \
 			QLabel#label { font-size: 30pt; } \
+			QLabel#stats { font-size: 8pt; color: grey; } \
 		");
 
 		layout = QVBoxLayout(self)
@@ -313,6 +442,12 @@ class GUI(QWidget):
 
 		self.enableSoundCardBtn = mkButton("&Enable sound", layout, self.enableSoundCardBtnClicked, isCheckable=True)
 
+		self.statsLabel = mkQLabel(layout=layout, objectName="stats")
+		self.statsLabel.setWordWrap(True)
+		self.statsTimer = QTimer()
+		self.statsTimer.timeout.connect(lambda: self.statsLabel.setText(self.sound.stats.summary()))
+		self.statsTimer.start(1000)
+
 		self.setWindowTitle("Sound Generator")
 		self.show()
 		self.setMaximumHeight(self.height())
@@ -330,9 +465,52 @@ class GUI(QWidget):
 		self.f.setValue(frequency)
 		self.f.blockSignals(False)
 
+WAVEFORMS = ['sine', 'sine2', 'sine3', 'triangle', 'square']
+
+def renderOffline(args):
+	sound = SoundGenerator(fs=args.fs)
+	sound.wavetableCacheDir = args.wavetable_cache
+	sound.setFrequency(args.frequency)
+	sound.setWaveFormType(WAVEFORMS.index(args.waveform))
+	sound.setVolume(args.volume)
+
+	buf = np.zeros(1000).astype(np.float32)
+	frames = int(round(args.duration * sound.fs))
+	with PcmWriter(args.render, sound.fs, args.format, args.raw) as writer:
+		while frames > 0:
+			count = min(frames, len(buf))
+			sound.render(buf[:count])
+			writer.write(buf[:count])
+			frames-=count
+
 def main():
-	app = QApplication(sys.argv)
-	gui = GUI()
+	parser = argparse.ArgumentParser(description="Sound generator. Opens the GUI, unless --render is given.")
+	parser.add_argument('--render', metavar='FILE', help="render offline as fast as possible to a WAV file ('-' for stdout)")
+	parser.add_argument('--raw', action='store_true', help="write raw PCM samples instead of WAV")
+	parser.add_argument('--format', choices=PcmWriter.FORMATS, default='float32', help="sample format (default: %(default)s)")
+	parser.add_argument('--fs', type=int, default=44100, help="sampling rate in Hz (default: %(default)s)")
+	parser.add_argument('--duration', type=float, default=10, help="duration in seconds (default: %(default)s)")
+	parser.add_argument('--frequency', type=float, default=100, help="frequency in Hz (default: %(default)s)")
+	parser.add_argument('--volume', type=float, default=0.1, help="amplitude, from 0 to 1 (default: %(default)s)")
+	parser.add_argument('--waveform', choices=WAVEFORMS, default='sine', help="waveform (default: %(default)s)")
+	parser.add_argument('--wavetable-cache', metavar='DIR', help="keep the band limited wavetables in this directory, not to compute them again")
+	addStreamArguments(parser)
+	addBackendArguments(parser)
+	addTunerArguments(parser)
+	args, qtArgs = parser.parse_known_args()
+
+	if args.render:
+		renderOffline(args)
+		return
+
+	app = QApplication(sys.argv[:1] + qtArgs)
+	gui = GUI(backend=makeBackend(args.backend, args.speed), framesPerBuffer=args.frames_per_buffer, buffers=args.buffers, process=args.process, tuner=makeTuner(args))
+	if args.stats_log:
+		# printed from the event loop, away from the audio callback
+		logTimer = QTimer()
+		logTimer.timeout.connect(gui.sound.stats.log)
+		logTimer.start(int(args.stats_log * 1000))
+	gui.sound.wavetableCacheDir = args.wavetable_cache
 	app.installEventFilter(gui)
 	ret = app.exec_()
 	sys.exit(ret)
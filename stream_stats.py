@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import sys, bisect
+
+# PortAudio callback status flags
+STATUS_FLAGS = {1: 'input underflow', 2: 'input overflow', 4: 'output underflow', 8: 'output overflow', 16: 'priming output'}
+
+class Histogram():
+	def __init__(self, bounds):
+		self.bounds = list(bounds) # upper bounds of the bins, the last bin has none
+		self.reset()
+
+	def reset(self):
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, value):
+		self.counts[bisect.bisect_left(self.bounds, value)]+=1
+		self.count+=1
+		self.total+=value
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def mean(self):
+		return self.total / self.count if self.count else None
+
+	def percentile(self, p):
+		# upper bound of the bin where the percentile falls
+		if not self.count:
+			return None
+		rank = self.count * p / 100.0
+		cumulated = 0
+		for i, count in enumerate(self.counts):
+			cumulated+=count
+			if cumulated >= rank and count:
+				return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+		return self.max
+
+	def snapshot(self):
+		return {'count': self.count, 'min': self.min, 'mean': self.mean(), 'max': self.max, 'p50': self.percentile(50), 'p99': self.percentile(99), 'bounds': list(self.bounds), 'counts': list(self.counts)}
+
+class StreamStats():
+	# 10us ... 0.33s, log scale
+	TIME_BOUNDS = [10e-6 * 2**i for i in range(16)]
+	DEPTH_BOUNDS = list(range(16))
+
+	# updated from the audio threads without locking, readers get a consistent enough view
+	def __init__(self):
+		self.generationTime = Histogram(self.TIME_BOUNDS)
+		self.slack = Histogram(self.TIME_BOUNDS)
+		self.queueDepth = Histogram(self.DEPTH_BOUNDS)
+		self.reset()
+
+	def reset(self):
+		self.callbacks = 0
+		self.underruns = 0
+		self.statusFlags = dict((name, 0) for name in STATUS_FLAGS.values())
+		self.generationTime.reset()
+		self.slack.reset()
+		self.queueDepth.reset()
+
+	def recordGeneration(self, seconds):
+		self.generationTime.add(seconds)
+
+	def recordCallback(self, status=0, queueDepth=None, slack=None):
+		self.callbacks+=1
+		if status:
+			for flag, name in STATUS_FLAGS.items():
+				if status & flag:
+					self.statusFlags[name]+=1
+		if queueDepth is not None:
+			self.queueDepth.add(queueDepth)
+		if slack is not None:
+			self.slack.add(slack)
+
+	def recordUnderrun(self):
+		self.underruns+=1
+
+	def snapshot(self):
+		return {
+			'callbacks': self.callbacks,
+			'underruns': self.underruns,
+			'status_flags': dict(self.statusFlags),
+			'generation_time': self.generationTime.snapshot(),
+			'slack': self.slack.snapshot(),
+			'queue_depth': self.queueDepth.snapshot(),
+		}
+
+	def log(self):
+		# from the GUI thread, never from the audio callback
+		print(self.summary(), file=sys.stderr)
+
+	def summary(self):
+		def ms(value):
+			return "-" if value is None else "%.2fms" % (value * 1000)
+		text = "callbacks %d, underruns %d, generation p50/p99/max %s/%s/%s, slack min %s" % (self.callbacks, self.underruns,
+			ms(self.generationTime.percentile(50)), ms(self.generationTime.percentile(99)), ms(self.generationTime.max), ms(self.slack.min))
+		if self.queueDepth.count:
+			text+=", queue depth min/avg %d/%.1f" % (self.queueDepth.min, self.queueDepth.mean())
+		flags = ["%s %d" % (name, count) for name, count in self.statusFlags.items() if count]
+		if flags:
+			text+=", " + ", ".join(flags)
+		return text
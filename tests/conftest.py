@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+import os, sys
+
+# the generators are standalone scripts at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
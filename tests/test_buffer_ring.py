@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import numpy as np
+import pytest
+
+from buffer_ring import BufferRing
+
+def fill(ring, value):
+	buf = ring.acquire(timeout=0)
+	assert buf is not None
+	buf[:] = value
+	ring.commit()
+	return buf
+
+def testDistinctBuffers():
+	ring = BufferRing(3, 16)
+	assert len(set(id(buf) for buf in ring.buffers)) == 3
+	assert all(buf.dtype == np.float32 and len(buf) == 16 for buf in ring.buffers)
+
+def testDepthTooSmall():
+	with pytest.raises(Exception):
+		BufferRing(1, 16)
+
+def testAtMostDepthMinusOneReady():
+	for depth in (2, 3, 5):
+		ring = BufferRing(depth, 16)
+		for i in range(depth - 1):
+			fill(ring, i)
+		assert ring.qsize() == depth - 1
+		assert ring.isFull()
+		assert ring.acquire(timeout=0) is None
+
+def testInFlightNeverAcquired():
+	for depth in (2, 3, 5):
+		ring = BufferRing(depth, 16)
+		for i in range(depth - 1):
+			fill(ring, i)
+		for i in range(depth - 1, 10 * depth):
+			inFlight = ring.pop()
+			expected = inFlight.copy()
+			# the producer refills everything it can while the consumer holds that buffer
+			while True:
+				buf = ring.acquire(timeout=0)
+				if buf is None:
+					break
+				assert buf is not inFlight
+				buf[:] = -1
+				ring.commit()
+			assert np.array_equal(inFlight, expected)
+
+def testOrder():
+	ring = BufferRing(4, 8)
+	for i in range(3):
+		fill(ring, i)
+	assert [ring.pop()[0] for i in range(3)] == [0, 1, 2]
+	assert ring.pop() is None
+
+def testSetLimit():
+	ring = BufferRing(5, 8)
+	ring.setLimit(2)
+	assert ring.limit == 2
+	fill(ring, 0) ; fill(ring, 1)
+	assert ring.isFull()
+	assert ring.acquire(timeout=0) is None
+	assert ring.waitReady(4, timeout=0) # waits for the limit at most
+
+	# raised back, without reallocating the ring
+	buffers = list(ring.buffers)
+	ring.setLimit(4)
+	assert ring.buffers == buffers
+	fill(ring, 2) ; fill(ring, 3)
+	assert ring.qsize() == 4 and ring.isFull()
+
+	# clamped between 1 and depth-1
+	ring.setLimit(0)
+	assert ring.limit == 1
+	ring.setLimit(100)
+	assert ring.limit == 4
+
+def testSetLimitWakesProducer():
+	ring = BufferRing(4, 8)
+	ring.setLimit(1)
+	fill(ring, 0)
+	acquired = []
+	producer = threading.Thread(target=lambda: acquired.append(ring.acquire(timeout=5)))
+	producer.start()
+	ring.setLimit(2)
+	producer.join()
+	assert acquired[0] is not None
+
+def testThreadedInFlightUntouched():
+	# sequence numbers written by a producer thread, checked while in flight on the consumer side
+	ring = BufferRing(3, 256)
+	count = 2000
+	def produce():
+		for i in range(count):
+			buf = ring.acquire(timeout=5)
+			buf[:] = i
+			ring.commit()
+	producer = threading.Thread(target=produce)
+	producer.start()
+	for i in range(count):
+		assert ring.waitReady(1, timeout=5)
+		buf = ring.pop()
+		assert (buf == i).all()
+		ring.waitReady(ring.limit, timeout=0.001) # give the producer time to overwrite it, if it could
+		assert (buf == i).all()
+	producer.join()
+
+def testSharedRingCountsSkippedFrames():
+	from process_worker import SharedBufferRing
+	ring = SharedBufferRing(3, 8)
+	try:
+		# counted on underruns only, at once with the pop that found no buffer
+		assert ring.pop(8) is None
+		assert ring.pop(8) is None
+		fill(ring, 0)
+		assert ring.pop(8) is not None
+		assert ring.skipped == 16
+	finally:
+		ring.close()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from audio_backends import SimulatedClockBackend
+from v23_generator import SoundGenerator
+
+def testLowLatencyKeystrokes():
+	# keys typed one at a time, the line idle in between, on a real time simulated clock
+	sound = SoundGenerator(backend=SimulatedClockBackend(1.0))
+	frames, buffers = sound.LOW_LATENCY_FRAMES_PER_BUFFER, sound.LOW_LATENCY_BUFFERS
+	sound.start(initialBreak=False, frames_per_buffer=frames, buffers=buffers)
+	try:
+		time.sleep(sound.waitSamples / sound.fs)
+		for i in range(20):
+			sound.write(b"x", keyTime=time.monotonic())
+			time.sleep(0.05)
+	finally:
+		sound.stop()
+
+	# the lookahead and the buffer in flight, with some scheduling slack
+	budget = buffers * frames / sound.fs + 0.02
+	assert sound.keyLatency.count == 20
+	assert sound.keyLatency.max < budget
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sys, os, time, queue, threading
-import numpy as np, pyaudio
+import sys, os, time, threading, collections, argparse
+import numpy as np
 
 try:
 	# sudo apt-get install python3-pyqt5
@@ -11,23 +11,100 @@ try:
 	from PyQt5.QtCore import *
 	from PyQt5.QtWidgets import *
 	PYQT_VERSION = 5
-	print("Using PyQt5")
+	print("Using PyQt5", file=sys.stderr)
 except:
 	# sudo apt-get install python-qtpy python3-qtpy
 	from PyQt4.QtGui import *
 	from PyQt4.QtCore import *
 	PYQT_VERSION = 4
-	print("Using PyQt4")
+	print("Using PyQt4", file=sys.stderr)
+
+from pcm_writer import PcmWriter
+from audio_backends import PortAudioBackend, makeBackend, addBackendArguments, paContinue
+from stream_stats import StreamStats, Histogram
+from process_worker import forwarded, cloneEngine
+from audio_stream import startStream, addStreamArguments
+from latency_tuner import addTunerArguments, makeTuner
+from wavetable import getWavetable, tuningWord, tuningWords, phaseRamp, phaseAdvance, PHASE_TYPE, TURN
+
+class SymbolFifo():
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.chunks = collections.deque()
+		self.count = 0
+		self.duration = 0.0 # in bits
+		self.durationTable = [1.0] # symbols durations (in bits), indexed by their codes
+
+	def durationCode(self, duration):
+		with self.lock:
+			if duration not in self.durationTable:
+				if len(self.durationTable) > 255:
+					raise Exception("Too many different symbol durations!")
+				self.durationTable.append(duration)
+			return self.durationTable.index(duration)
+
+	def durations(self, codes):
+		return np.array(self.durationTable)[codes]
+
+	def put(self, bits, codes):
+		duration = self.durations(codes).sum()
+		with self.lock:
+			self.chunks.append((bits, codes))
+			self.count+=len(bits)
+			self.duration+=duration
+
+	def unget(self, bits, codes):
+		if len(bits):
+			duration = self.durations(codes).sum()
+			with self.lock:
+				self.chunks.appendleft((bits, codes))
+				self.count+=len(bits)
+				self.duration+=duration
+
+	def get(self, count):
+		bits, codes = [], []
+		with self.lock:
+			while count > 0 and self.chunks:
+				b, c = self.chunks.popleft()
+				if len(b) > count:
+					self.chunks.appendleft((b[count:], c[count:]))
+					b, c = b[:count], c[:count]
+				bits.append(b); codes.append(c)
+				count-=len(b)
+				self.count-=len(b)
+
+		if not bits:
+			return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8)
+		bits, codes = np.concatenate(bits), np.concatenate(codes)
+		duration = self.durations(codes).sum()
+		with self.lock:
+			self.duration = max(0.0, self.duration - duration)
+		return bits, codes
+
+	def qsize(self):
+		return self.count
+
+	def clear(self):
+		with self.lock:
+			self.chunks.clear()
+			self.count = 0
+			self.duration = 0.0
 
 class SoundGenerator():
 	FRAMES_PER_BUFFER = 1000
-	def __init__(self, fs=44100):
+	# interactive typing: about 9ms of lookahead at 44.1kHz instead of 113ms
+	LOW_LATENCY_FRAMES_PER_BUFFER = 128
+	LOW_LATENCY_BUFFERS = 3
+	FRAME_TABLES_CACHE_SIZE = 4
+	# mirrored from the synthesis process
+	PROCESS_STATUS = ['phase', 'volume', 'symbolsPlayed', 'waitSamples', 'queue.duration', 'bitsWritten', 'keyStartSample', 'keyStartTime', 'symbolsModulated', 'bitsModulated', 'symbolSamples']
+	def __init__(self, fs=44100, debug=False, backend=None, process=False):
 		self.newFrequency = None
 		self.newVolume = 0
 		self.fs = float(fs)
 		self.volume = 0
 		self.frequency = 0
-		self.deltaPhase = 0
+		self.deltaPhase = 0 # DDS tuning word
 		self.encoding = 'ascii'
 		self.baudRate = 1200
 		self.setFrequencies()
@@ -35,121 +112,309 @@ class SoundGenerator():
 		self.parity = True
 		self.parityOdd = False
 		self.stopBits = 1
+		self.frameTables = collections.OrderedDict()
+		self.frameTable = None
 		self.stream = None
+		self.backend = backend if backend is not None else PortAudioBackend()
+		self.stats = StreamStats()
 		self.frame_count = None
-		self.p = pyaudio.PyAudio()
-		self.queue = queue.Queue()
+		self.buffersNbr = 5
+		self.ring = None
+		self.running = False
+		self.stateLock = threading.Lock() # modulator state, shared with the callback on underruns
+		self.writeLock = threading.Lock() # write() is called from the GUI, the file sending window and the virtual serial port
+		self.lastBufferEndPhase = 0
+		self.useProcess = process
+		self.worker = None
+		self.tuner = None
+		self.queue = SymbolFifo()
+		self.debug = debug
+		self.symbolsWritten = 0
+		self.symbolsPlayed = 0
+		# durations (in bits) queued by write(), and in process mode sent to the synthesis process
+		self.bitsWritten = 0.0
+		self.bitsSent = 0.0
+		# keystroke to start bit latency: (first symbol index, key time) from write(),
+		# then (sample index, key time) from render() for the callback to time when it is heard
+		self.keyMarks = collections.deque()
+		self.keyStarts = collections.deque(maxlen=256)
+		self.keyStartSample = -1 # last one of the buffer, for the synthesis process to report it
+		self.keyStartTime = 0.0
+		self.keyLatency = Histogram(StreamStats.TIME_BOUNDS)
+		self.samplesRendered = 0
+		self.samplesPopped = 0
+		# symbols started, their duration in bits and in samples: when rendered, and when handed to the audio output
+		self.symbolsModulated = 0 ; self.bitsModulated = 0.0 ; self.symbolSamples = 0
+		self.symbolsOnAir = 0 ; self.bitsOnAir = 0.0 ; self.symbolSamplesOnAir = 0
+		self.symbolsOnAirBase = 0 # symbolsWritten at the last reset
+		self.bufferMarks = collections.deque(maxlen=256) # (samplesRendered, symbolsModulated, bitsModulated, symbolSamples) after each buffer
 		self.waitSamples = 0
 		self.lastSymbolTimeError = 0.0
+		self.phase = 0
+		self.volumeDecay = 0.999**np.arange(self.FRAMES_PER_BUFFER)
 
-		self.output_device_index = -1
-		for i in range(self.p.get_device_count()):
-			name = self.p.get_device_info_by_index(i)['name']
-			if 'pipewire' in name:
-				self.output_device_index = i
-			print("%2d %s%s" % (i, "*" if self.output_device_index == i else "", name))
 
-	def start(self, fs=None, initialBreak=True):
+	def start(self, fs=None, initialBreak=True, frames_per_buffer=None, buffers=None):
 		if self.stream is None:
 			if fs != None:
 				self.fs = float(fs)
-			self.buffers = []
-			self.buffersNbr = 5
-			self.bufferQueue = queue.Queue(maxsize=self.buffersNbr-1)
-			for i in range(self.buffersNbr):
-				self.buffers.append(np.zeros(self.FRAMES_PER_BUFFER).astype(np.float32))
-			self.bufIn, self.bufOut = -1, -1
-			self.phase = 0
-			self.queue.queue.clear()
-
-			if initialBreak:
-				self.setFrequency(self.frequencySpace)
-				self.waitSamples = int(2.0*self.fs)
-			else:
-				self.setFrequency(self.frequencyIdle)
-				self.waitSamples = int(0.5*self.fs)
-
-			self.stream = self.p.open(format=pyaudio.paFloat32, channels=1, rate=int(self.fs), output=True, stream_callback=self.callback, output_device_index=self.output_device_index,frames_per_buffer=self.FRAMES_PER_BUFFER)
-			self.stream.start_stream()
-
-			self.thread = threading.Thread(target=self.fillingBufferWorker)
-			self.thread.start()
+			frames_per_buffer = frames_per_buffer or self.FRAMES_PER_BUFFER
+			buffers = buffers or self.buffersNbr
+			if self.tuner is not None:
+				frames_per_buffer, buffers = self.tuner.calibrate(self.calibrationEngine().render, self.fs, self.backend)
+			self.idleBuffer = np.zeros(frames_per_buffer).astype(np.float32)
+			self.reset(initialBreak)
+			self.stats.reset()
+			self.keyLatency.reset()
+
+			startStream(self, frames_per_buffer, buffers, self.startFillingThread)
+
+	def startFillingThread(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.fillingBufferWorker)
+		self.thread.start()
+
+	def calibrationEngine(self):
+		# modulating random bytes, with our settings
+		engine = cloneEngine(self)
+		engine.debug = False
+		engine.waitSamples = 0
+		engine.write(np.random.RandomState(0).randint(0, 256, 4096).astype(np.uint8).tobytes())
+		return engine
+
+	def reset(self, initialBreak=True):
+		self.phase = 0
+		self.lastBufferEndPhase = 0
+		with self.writeLock:
+			self.queue.clear()
+			self.bitsWritten = self.bitsSent = 0.0
+			self.symbolsPlayed = self.symbolsWritten
+			self.symbolsOnAirBase = self.symbolsWritten
+			self.keyMarks.clear()
+			self.keyStarts.clear()
+		self.samplesRendered = 0
+		self.samplesPopped = 0
+		self.symbolsModulated = 0 ; self.bitsModulated = 0.0 ; self.symbolSamples = 0
+		self.symbolsOnAir = 0 ; self.bitsOnAir = 0.0 ; self.symbolSamplesOnAir = 0
+		self.bufferMarks.clear()
+
+		if initialBreak:
+			self.setFrequency(self.frequencySpace)
+			self.waitSamples = int(2.0*self.fs)
+		else:
+			self.setFrequency(self.frequencyIdle)
+			self.waitSamples = int(0.5*self.fs)
 
 	def callback(self, in_data, frame_count, time_info, status):
 		self.frame_count = frame_count
-		if self.bufferQueue.empty():
-			print("BUFFER UNDERRUN!")
-
-		self.bufOut = self.bufferQueue.get(block=True)
-		return self.buffers[self.bufOut], pyaudio.paContinue
+		# in process mode, the idle fill frames are counted for the synthesis process to follow them
+		buf = self.ring.pop(frame_count) if self.worker is not None else self.ring.pop()
+		if buf is None:
+			# never wait for the filling thread here, keep the line idle until it catches up
+			self.stats.recordUnderrun()
+			buf = self.idleFill(frame_count)
+		else:
+			self.updateOnAir(frame_count, time_info)
+
+		queueDepth = self.ring.qsize()
+		self.stats.recordCallback(status, queueDepth, queueDepth * frame_count / self.fs)
+		if self.tuner is not None:
+			self.tuner.update(self.stats, self.ring)
+		return buf, paContinue
+
+	def updateOnAir(self, frames, time_info):
+		start = self.samplesPopped
+		self.samplesPopped+=frames
+		if self.worker is not None:
+			# values of the buffer just popped
+			self.symbolsOnAir, self.bitsOnAir, self.symbolSamplesOnAir = self.symbolsModulated, self.bitsModulated, self.symbolSamples
+			if self.keyStartSample >= 0:
+				self.keyStarts.append((self.keyStartSample, self.keyStartTime))
+		else:
+			while self.bufferMarks and self.bufferMarks[0][0] <= self.samplesPopped:
+				self.symbolsOnAir, self.bitsOnAir, self.symbolSamplesOnAir = self.bufferMarks.popleft()[1:]
+
+		if self.keyStarts and self.keyStarts[0][0] < self.samplesPopped:
+			# the DAC times are on the stream clock, only their difference with its current time is meaningful here
+			outputLatency = max(0.0, time_info['output_buffer_dac_time'] - time_info['current_time']) if time_info else 0.0
+			now = time.monotonic()
+			while self.keyStarts and self.keyStarts[0][0] < self.samplesPopped:
+				sample, keyTime = self.keyStarts.popleft()
+				self.keyLatency.add(now + outputLatency + (sample - start) / self.fs - keyTime)
+
+	def idleFill(self, frames):
+		if len(self.idleBuffer) != frames:
+			self.idleBuffer = np.zeros(frames).astype(np.float32)
+
+		# continue from the modulator phase if the filling thread isn't busy with it, otherwise from the end of the last buffer
+		deltaPhase = tuningWord(self.frequencyIdle, self.fs)
+		sine = getWavetable('sine')
+		if self.stateLock.acquire(blocking=False):
+			try:
+				self.idleBuffer[:] = self.volume * sine.render(phaseRamp(self.phase, deltaPhase, frames), self.frequencyIdle, self.fs)
+				self.phase = phaseAdvance(self.phase, deltaPhase, frames)
+				self.lastBufferEndPhase = self.phase
+			finally:
+				self.stateLock.release()
+		else:
+			self.idleBuffer[:] = self.volume * sine.render(phaseRamp(self.lastBufferEndPhase, deltaPhase, frames), self.frequencyIdle, self.fs)
+			self.lastBufferEndPhase = phaseAdvance(self.lastBufferEndPhase, deltaPhase, frames)
+		return self.idleBuffer
 
 	def fillingBufferWorker(self):
-		while(self.stream is not None):
-			buf = self.buffers[self.bufIn]
-
-			for n in range(self.FRAMES_PER_BUFFER):
-				if self.waitSamples > 0:
-					self.waitSamples-=1
-				else:
-					try:
-						f, d = self.queue.get_nowait()
-						self.setFrequency(f)
-						waitSamplesFloat = ((d * self.fs) / self.baudRate) - self.lastSymbolTimeError - 1
-						self.waitSamples = int(round(waitSamplesFloat))
-						self.lastSymbolTimeError = self.waitSamples - waitSamplesFloat
-					except:
-						self.setFrequency(self.frequencyIdle)
-
-				buf[n] = self.volume * np.sin(self.phase)
-
-				# update phase for each sample
-				self.phase+=self.deltaPhase
-				if self.phase > 2*np.pi:
-					self.phase-=2*np.pi
-
-				# low pass filter for volume control
-				if self.newVolume != None:
-					self.volume, self.oldVolume = self.volume * 0.999 + self.newVolume * 0.001, self.volume
-					if self.volume == self.oldVolume:
-						self.volume, self.newVolume = self.newVolume, None
-
-			try:
-				self.bufferQueue.put(self.bufIn, timeout=1)
-			except queue.Full:
-				return
+		ring = self.ring
+		while self.running:
+			buf = ring.acquire(timeout=0.1)
+			if buf is None:
+				continue
+
+			with self.stateLock:
+				start = time.perf_counter()
+				startPhase = self.phase
+				self.render(buf)
+				self.stats.recordGeneration(time.perf_counter() - start)
+
+				# idle fills played meanwhile from lastBufferEndPhase, the buffer follows them
+				while self.lastBufferEndPhase != startPhase:
+					endPhase = self.lastBufferEndPhase
+					self.shiftLastRender(buf, (endPhase - startPhase) % TURN)
+					startPhase = endPhase
+				self.lastBufferEndPhase = self.phase
+				# committed under the lock, for idle fills not to start from the end of a buffer still to be played
+				ring.commit()
+
+	def skipFrames(self, buf, frames):
+		# in the synthesis process: the parent played frames of idle fill before buf
+		self.shiftLastRender(buf, tuningWord(self.frequencyIdle, self.fs) * frames % TURN)
+
+	def shiftLastRender(self, buf, deltaPhase):
+		# same buffer, deltaPhase later
+		phase, volume, frequency = self.lastRender
+		phase+=PHASE_TYPE(deltaPhase)
+		buf[:] = volume * getWavetable('sine').render(phase, frequency, self.fs)
+		self.phase = (self.phase + deltaPhase) % TURN
+
+	def render(self, buf):
+		frames = len(buf)
+		frequencies, counts = [], []
+		self.keyStartSample = -1
+		n = 0
+		while n < frames:
+			if self.waitSamples > 0:
+				count = min(self.waitSamples, frames - n)
+				frequencies.append(self.frequency)
+				counts.append(count)
+				self.waitSamples-=count
+				n+=count
+				continue
+
+			bits, codes = self.queue.get(int((frames - n) * self.baudRate / self.fs) + 1)
+			if len(bits) == 0:
+				self.setFrequency(self.frequencyIdle)
+				frequencies.append(self.frequency)
+				counts.append(frames - n)
+				break
+
+			# symbols boundaries, keeping the fractional part of the timing error for the next ones
+			f = np.where(bits, self.frequencyMark, self.frequencySpace)
+			durations = self.queue.durations(codes)
+			ideal = np.cumsum(durations * self.fs / self.baudRate) - self.lastSymbolTimeError
+			ends = np.round(ideal).astype(int)
+			starting = int(np.searchsorted(ends[:-1], frames - n)) + 1
+			self.queue.unget(bits[starting:], codes[starting:])
+			while self.keyMarks and self.keyMarks[0][0] < self.symbolsPlayed + starting:
+				index, keyTime = self.keyMarks.popleft()
+				if index >= self.symbolsPlayed:
+					j = index - self.symbolsPlayed
+					self.keyStartSample = self.samplesRendered + n + (int(ends[j-1]) if j else 0)
+					self.keyStartTime = keyTime
+					self.keyStarts.append((self.keyStartSample, keyTime))
+			self.symbolsPlayed+=starting
+			self.symbolsModulated+=starting
+			self.bitsModulated+=float(durations[:starting].sum())
+			self.symbolSamples+=int(ends[starting-1])
+			self.lastSymbolTimeError = ends[starting-1] - ideal[starting-1]
+
+			lengths = np.diff(ends[:starting], prepend=0)
+			self.waitSamples = max(0, ends[starting-1] - (frames - n))
+			lengths[-1]-=self.waitSamples
+			self.setFrequency(f[starting-1])
+			frequencies.extend(f[:starting])
+			counts.extend(lengths)
+			n+=int(lengths.sum())
+
+		# integrate phase over the whole buffer
+		deltaPhase = np.repeat(tuningWords(frequencies, self.fs), counts)
+		phase = np.cumsum(deltaPhase, dtype=PHASE_TYPE)
+		phase+=PHASE_TYPE(self.phase) - deltaPhase
+		self.phase = phaseAdvance(int(phase[-1]), int(deltaPhase[-1]), 1)
+
+		# low pass filter for volume control, in closed form
+		if len(self.volumeDecay) < frames:
+			self.volumeDecay = 0.999**np.arange(frames)
+		if self.newVolume != None:
+			volume = self.newVolume + (self.volume - self.newVolume) * self.volumeDecay[:frames]
+			self.volume = self.newVolume + (self.volume - self.newVolume) * 0.999**frames
+			if abs(self.volume - self.newVolume) < 1e-7:
+				self.volume, self.newVolume = self.newVolume, None
+		else:
+			volume = self.volume
 
-			self.bufIn = (self.bufIn + 1) % self.buffersNbr
+		buf[:] = volume * getWavetable('sine').render(phase, max(frequencies), self.fs)
+		self.lastRender = phase, volume, max(frequencies)
+		self.samplesRendered+=frames
+		self.bufferMarks.append((self.samplesRendered, self.symbolsModulated, self.bitsModulated, self.symbolSamples))
 
 	def stop(self):
 		if self.stream is not None:
 			self.stream.stop_stream()
 			self.stream.close()
 			self.stream = None
+			if self.worker is not None:
+				self.worker.stop()
+				self.worker = None
+			else:
+				self.running = False
+				self.thread.join()
 
 	def __del__(self):
 		self.stream = None
-		self.p.terminate()
+		self.backend.terminate()
 
 	def isActive(self):
 		if self.stream == None:
 			return False
 		return self.stream.is_active()
 
+	@forwarded
 	def setFrequency(self, frequency):
 		self.frequency = frequency
-		self.deltaPhase = 2*np.pi*self.frequency/self.fs
+		self.deltaPhase = tuningWord(self.frequency, self.fs)
 
+	@forwarded
 	def setFrequencies(self, mark=1300, space=2100, idle=1300):
 		self.frequencyIdle = idle
 		self.frequencyMark = mark # 1
 		self.frequencySpace = space # 0
 
+	@forwarded
 	def setBaudRate(self, baudRate):
 		self.baudRate = baudRate
 
 	def setEncoding(self, encoding):
 		self.encoding = encoding
 
+	@forwarded
+	def setBits(self, bits):
+		self.bits = bits
+		self.frameTable = None
+
+	@forwarded
+	def setStopBits(self, stopBits):
+		self.stopBits = stopBits
+		self.frameTable = None
+
+	@forwarded
 	def setParity(self, parityType):
 		if parityType == "n":
 			self.parity = False; self.parityOdd = False
@@ -159,38 +424,169 @@ class SoundGenerator():
 			self.parity = True;  self.parityOdd = True
 		else:
 			raise Exception("setParity() should be called with 'o' or 'e' or 'n'!")
+		self.frameTable = None
 
+	@forwarded
 	def setVolume(self, volume):
 		self.newVolume = volume
 
-	def write(self, data):
-		self.outStr=""
-		def addBitToQueue(bit, duration=1):
-			self.outStr += "1" if bit else "0"
-			self.queue.put((self.frequencyMark if bit else self.frequencySpace, duration))
+	def getFrameTable(self):
+		key = (self.bits, self.parity, self.parityOdd, self.stopBits)
+		if self.frameTable is not None and self.frameTable[0] == key:
+			return self.frameTable[1:]
 
+		if key in self.frameTables:
+			self.frameTables.move_to_end(key)
+		else:
+			# START BIT, LSB ... MSB, PARITY BIT, STOP BIT, for each byte value
+			bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1, bitorder='little')
+			if self.bits > 8:
+				bits = np.pad(bits, ((0, 0), (0, self.bits - 8)))
+			frames = [np.zeros((256, 1), dtype=np.uint8), bits[:, :self.bits]]
+			if self.parity:
+				frames.append(((frames[1].sum(axis=1, keepdims=True) + self.parityOdd) & 1).astype(np.uint8))
+			frames.append(np.ones((256, 1), dtype=np.uint8))
+			frames = np.hstack(frames)
+
+			codes = np.zeros(frames.shape[1], dtype=np.uint8)
+			codes[-1] = self.queue.durationCode(self.stopBits)
+			self.frameTables[key] = (frames, codes)
+			while len(self.frameTables) > self.FRAME_TABLES_CACHE_SIZE:
+				self.frameTables.popitem(last=False)
+
+		self.frameTable = (key,) + self.frameTables[key]
+		return self.frameTable[1:]
+
+	def write(self, data, keyTime=None):
+		# keyTime: time.monotonic() of the key press, to measure the latency until its first start bit is heard
+		# returns symbolsWritten once data is queued, the position of its end in the stream
 		if type(data) != bytes:
 			data = data.encode(self.encoding)
+		data = np.frombuffer(data, dtype=np.uint8)
+
+		with self.writeLock:
+			table, codes = self.getFrameTable()
+			frames = table[data]
+			bits = float(self.queue.durations(codes).sum()) * len(data)
+			if self.worker is not None:
+				# queued (and printed) by the synthesis process
+				self.bitsSent+=bits
+				self.symbolsWritten+=frames.size
+				self.worker.call('write', data.tobytes(), keyTime)
+				return self.symbolsWritten
+
+			if keyTime is not None:
+				self.keyMarks.append((self.symbolsWritten, keyTime))
+			self.symbolsWritten+=frames.size
+			self.bitsWritten+=bits
+
+			self.queue.put(frames.ravel(), np.tile(codes, len(data)))
+
+		if self.debug:
+			print(" ".join("".join(map(str, frame)) for frame in frames), file=sys.stderr)
+		return self.symbolsWritten
+
+	def byteDuration(self):
+		table, codes = self.getFrameTable()
+		return self.queue.durations(codes).sum() / self.baudRate
+
+	def queuedSeconds(self):
+		# in process mode, queue.duration and bitsWritten are those of the last buffer the synthesis process
+		# reported, the writes it had not received then are still to be added
+		pending = max(0.0, self.bitsSent - self.bitsWritten) if self.worker is not None else 0.0
+		return (self.queue.duration + pending) / self.baudRate + self.waitSamples / self.fs
+
+	def symbolsHeard(self):
+		# like symbolsPlayed, but counting the symbols handed to the audio output instead of those rendered ahead
+		return self.symbolsOnAirBase + self.symbolsOnAir
+
+	def transmissionMetrics(self, pendingBytes=0):
+		# what reached the audio output so far, and when pendingBytes more would have
+		table, codes = self.getFrameTable()
+		bitsPerByte = float(self.queue.durations(codes).sum())
+		busySeconds = self.symbolSamplesOnAir / self.fs
+		# timing corrections included, the symbols being rounded to whole samples
+		effectiveBaudRate = self.bitsOnAir / busySeconds if busySeconds else None
+		rendered = self.ring.qsize() * self.frame_count / self.fs if self.ring is not None and self.frame_count else 0.0
+		queuedSeconds = float(self.queuedSeconds()) + rendered
+		return {
+			'symbols_on_air': self.symbolsOnAir,
+			'seconds_on_air': self.samplesPopped / self.fs,
+			'busy_seconds': busySeconds,
+			'effective_baud_rate': effectiveBaudRate,
+			'bytes_per_second': (effectiveBaudRate or self.baudRate) / bitsPerByte,
+			'queued_seconds': queuedSeconds,
+			'eta_seconds': queuedSeconds + pendingBytes * bitsPerByte / (effectiveBaudRate or self.baudRate),
+		}
+
+class VirtualSerialPort():
+	# pseudo-terminal other programs can open and write to like a serial port. Its data is only read once
+	# the sound queued falls below maxQueuedSeconds, until then the pty buffer fills up and the writers
+	# block, like with RTS/CTS flow control.
+	MAX_READ_SIZE = 4096
+
+	def __init__(self, sound, maxQueuedSeconds=0.5, link=None):
+		if not hasattr(os, 'openpty'):
+			raise Exception("Pseudo-terminals are not available on this platform!")
+		if link and os.path.lexists(link) and not os.path.islink(link):
+			raise Exception("%s already exists and is not a symbolic link!" % link)
+		# POSIX only
+		import tty
+		self.sound = sound
+		self.maxQueuedSeconds = maxQueuedSeconds
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.slave) # 8 bits transparent, no echo
+		self.name = os.ttyname(self.slave)
+		self.link = link
+		if self.link:
+			try:
+				if os.path.islink(self.link):
+					os.unlink(self.link)
+				os.symlink(self.name, self.link)
+			except OSError as e:
+				os.close(self.master)
+				os.close(self.slave)
+				raise Exception("Cannot link %s to %s: %s!" % (self.link, self.name, e.strerror))
+		self.bytesRead = 0
+
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="Virtual Serial Port")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		import select
+		while self.running:
+			# what fits below the limit, at least a byte
+			room = self.maxQueuedSeconds - self.sound.queuedSeconds()
+			if room <= 0:
+				time.sleep(min(-room, 0.1))
+				continue
+
+			# leave the data in the pty until the sound is enabled, start() would drop it
+			if not self.sound.isActive():
+				time.sleep(0.1)
+				continue
+
+			if not select.select([self.master], [], [], 0.1)[0]:
+				continue
+			try:
+				data = os.read(self.master, max(1, min(self.MAX_READ_SIZE, int(room / self.sound.byteDuration()))))
+			except OSError:
+				continue
+			try:
+				self.sound.write(data)
+			except Exception as e:
+				print(e, file=sys.stderr)
+			self.bytesRead+=len(data)
 
-		for bc in data:
-			if type(bc) == str:
-				bc = ord(bc) # for python 2.x
-			self.outStr += " " if self.outStr else ""
-			parityState = self.parityOdd
-			addBitToQueue(0) # START BIT
-			for p in range(0, self.bits): # LSB ... MSB
-				if 2**p & bc:
-					addBitToQueue(1)
-					parityState = not parityState
-				else:
-					addBitToQueue(0)
-
-			if self.parity:
-				addBitToQueue(1 if parityState else 0) # PARITY BIT
-
-			addBitToQueue(1, self.stopBits) # STOP BIT
-
-		print(self.outStr)
+	def close(self):
+		self.running = False
+		self.thread.join()
+		os.close(self.master)
+		os.close(self.slave)
+		if self.link and os.path.islink(self.link):
+			os.unlink(self.link)
 
 def mkQLabel(text=None, layout=None, alignment=Qt.AlignLeft, objectName=None):
 	o = QLabel()
@@ -223,8 +619,11 @@ class MyQPlainTextEdit(QPlainTextEdit):
 	def __init__(self):
 		QPlainTextEdit.__init__(self)
 		self.setAcceptDrops(False)
+		self.keyTime = None
 
 	def keyPressEvent(self, event):
+		# event.timestamp() isn't on a clock we can compare with, take the time it is delivered
+		self.keyTime = time.monotonic()
 		key = event.key()
 		if event.modifiers() & Qt.CTRL:
 			self.keyPressWithControlPressed.emit(key)
@@ -233,13 +632,23 @@ class MyQPlainTextEdit(QPlainTextEdit):
 
 
 class FileSendingWindow(QDialog):
+	CHUNK_SIZE = 65536
+	QUEUED_SECONDS = 1.0
+	RATE_WINDOW = 5.0 # seconds the throughput is averaged over
+
 	def __init__(self, parent, sound, filename):
 		QDialog.__init__(self, parent)
 		self.setAttribute(Qt.WA_DeleteOnClose)
 		self.timer = QTimer(self)
+		self.fd = None
 		try:
 			self.sound = sound
 			self.fd = open(filename, "rb")
+			self.bytesRead = 0
+			self.bytesPlayed = 0
+			self.chunks = collections.deque() # (symbolsWritten, bytesRead, symbols per byte) after each chunk
+			self.fileSize = os.path.getsize(filename)
+			self.history = collections.deque() # (time, bytesPlayed)
 			self.setWindowTitle("Transmitting file")
 			self.setMinimumWidth(300)
 			self.layout = QVBoxLayout(self)
@@ -247,14 +656,16 @@ class FileSendingWindow(QDialog):
 			self.layout.addWidget(self.label)
 			self.progressBar = QProgressBar()
 			self.progressBar.setValue(0)
-			self.progressBar.setMaximum(os.path.getsize(filename))
+			self.progressBar.setMaximum(self.fileSize)
 			self.layout.addWidget(self.progressBar)
+			self.metricsLabel = QLabel()
+			self.layout.addWidget(self.metricsLabel)
 			self.cancelButton = QPushButton("Stop")
 			self.cancelButton.clicked.connect(self.cancel)
 			self.layout.addWidget(self.cancelButton)
 			self.show()
 			self.timer.timeout.connect(self.send)
-			self.timer.start(50)
+			self.timer.start(100)
 		except Exception as e:
 			QMessageBox.critical(self, "Error", str(e))
 			self.close()
@@ -263,46 +674,107 @@ class FileSendingWindow(QDialog):
 		if self.sound.stream is None:
 			return
 		try:
-			while self.sound.queue.qsize() < self.sound.baudRate * 0.2:
-				c = self.fd.read(1)
-				if c == b'':
-					self.timer.stop()
-					QTimer.singleShot(1000, self.close)
+			# keep about QUEUED_SECONDS of audio waiting to be modulated
+			while self.fd is not None:
+				queuedSeconds = self.sound.queuedSeconds()
+				if queuedSeconds >= self.QUEUED_SECONDS:
+					break
+				size = min(self.CHUNK_SIZE, int((self.QUEUED_SECONDS - queuedSeconds) / self.sound.byteDuration()) + 1)
+				data = self.fd.read(size)
+				if data == b'':
+					self.fd.close()
+					self.fd = None
 					break
-				self.sound.write(c)
-			self.progressBar.setValue(self.fd.tell())
+				symbolsPerByte = self.sound.getFrameTable()[0].shape[1]
+				symbolsWritten = self.sound.write(data)
+				self.bytesRead+=len(data)
+				self.chunks.append((symbolsWritten, self.bytesRead, symbolsPerByte))
+
+			self.progressBar.setValue(self.updateBytesPlayed())
+			self.metricsLabel.setText(self.metricsText())
+			if self.fd is None and not self.chunks:
+				self.timer.stop()
+				QTimer.singleShot(1000, self.close)
 
 		except Exception as e:
 			self.timer.stop()
 			QMessageBox.critical(self, "Error", str(e))
 			self.close()
 
+	def updateBytesPlayed(self):
+		symbolsHeard = self.sound.symbolsHeard()
+		while self.chunks:
+			symbolsWritten, bytesRead, symbolsPerByte = self.chunks[0]
+			if symbolsWritten > symbolsHeard:
+				self.bytesPlayed = max(self.bytesPlayed, bytesRead - int((symbolsWritten - symbolsHeard) / symbolsPerByte))
+				break
+			self.bytesPlayed = bytesRead
+			self.chunks.popleft()
+		return self.bytesPlayed
+
+	def bytesPerSecond(self):
+		# measured on the sound handed to the audio output
+		now = time.monotonic()
+		self.history.append((now, self.bytesPlayed))
+		while now - self.history[0][0] > self.RATE_WINDOW:
+			self.history.popleft()
+		if now - self.history[0][0] < 0.5:
+			return None
+		return (self.history[-1][1] - self.history[0][1]) / (now - self.history[0][0])
+
+	def metricsText(self):
+		metrics = self.sound.transmissionMetrics(self.fileSize - self.bytesRead)
+		bytesPerSecond = self.bytesPerSecond()
+		eta = int(round(metrics['eta_seconds']))
+		text = "%s bytes/s, " % ("-" if bytesPerSecond is None else "%.1f" % bytesPerSecond)
+		if metrics['effective_baud_rate']:
+			text+="%.2f bauds, " % metrics['effective_baud_rate']
+		return text + "%.1fs queued, %d:%02d:%02d left" % (metrics['queued_seconds'], eta // 3600, eta // 60 % 60, eta % 60)
+
 	def closeEvent(self, event):
 		self.timer.stop()
+		if self.fd is not None:
+			self.fd.close()
+			self.fd = None
 
 	def cancel(self):
 		self.close()
 
 
 class GUI(QWidget):
-	def __init__(self):
+	def __init__(self, debug=False, backend=None, process=False, tuner=None, lowLatency=False, pty=None):
 		QWidget.__init__(self)
+		self.lowLatency = lowLatency
 		self.initUI()
-		self.sound = SoundGenerator()
+		self.sound = SoundGenerator(debug=debug, backend=backend, process=process)
+		self.sound.tuner = tuner
+		if tuner is not None:
+			tuner.calibrateInBackground(self.sound.calibrationEngine().render, self.sound.fs, self.sound.backend)
+
+		self.serialPort = None
+		if pty is not None:
+			try:
+				self.serialPort = VirtualSerialPort(self.sound, link=pty or None)
+			except Exception as e:
+				QMessageBox.critical(self, "Error", "Cannot open the virtual serial port: %s" % e)
+				return
+			print("Virtual serial port: %s" % (pty or self.serialPort.name), file=sys.stderr)
+			self.setWindowTitle("V23 Sound Generator - %s" % (pty or self.serialPort.name))
 
 	def initUI(self):
 		self.setStyleSheet("\
 			QLabel { margin: 0px; padding: 0px; } \
 			QPlainTextEdit { color: #00ff00; background: #000000; font-family: Monospace; font-size: 18px; } \
+			QLabel#stats { font-size: 8pt; color: grey; } \
 		");
 
 		layout = QVBoxLayout(self)
 
 		# where we'll be typing stuff
 		self.editor = MyQPlainTextEdit()
-		self.editor.lastLen = 0
+		self.editorResetting = False # editor changes not to be transmitted
 		self.editor.setWordWrapMode(QTextOption.NoWrap)
-		self.editor.textChanged.connect(self.editorTextChanged)
+		self.editor.document().contentsChange.connect(self.editorContentsChange)
 		self.editor.keyPressWithControlPressed.connect(self.editorKeyWithControlPressed)
 		self.editor.cursorPositionChanged.connect(lambda: self.editor.moveCursor(QTextCursor.End))
 		layout.addWidget(self.editor)
@@ -333,7 +805,7 @@ class GUI(QWidget):
 		self.bitsCombo.setCurrentIndex(0)
 		def fct():
 			try:
-				self.sound.bits = int(self.bitsCombo.currentText())
+				self.sound.setBits(int(self.bitsCombo.currentText()))
 			except:
 				self.bitsCombo.setEditText("%d" % self.sound.bits)
 		self.bitsCombo.currentTextChanged.connect(fct)
@@ -350,7 +822,7 @@ class GUI(QWidget):
 		self.stopBitsCombo.setCurrentIndex(0)
 		def fct():
 			try:
-				self.sound.stopBits = float(self.stopBitsCombo.currentText())
+				self.sound.setStopBits(float(self.stopBitsCombo.currentText()))
 			except:
 				self.stopBitsCombo.setEditText("%d" % self.sound.stopBits)
 		self.stopBitsCombo.currentTextChanged.connect(fct)
@@ -444,6 +916,12 @@ class GUI(QWidget):
 		self.sendFileBtn.setEnabled(False)
 		layout.addLayout(layout2)
 
+		self.statsLabel = mkQLabel(layout=layout, objectName="stats")
+		self.statsLabel.setWordWrap(True)
+		self.statsTimer = QTimer()
+		self.statsTimer.timeout.connect(self.refreshStats)
+		self.statsTimer.start(1000)
+
 		# for each combobox
 		for c in self.encodingCombo, self.baudRateCombo, self.bitsCombo, self.stopBitsCombo:
 				c.setEditable(True)
@@ -475,10 +953,19 @@ class GUI(QWidget):
 			for filename in dialog.selectedFiles():
 				FileSendingWindow(self, self.sound, filename)
 
+	def refreshStats(self):
+		text = self.sound.stats.summary()
+		if self.sound.keyLatency.count:
+			text+=", keystroke to start bit avg/max %.1fms/%.1fms" % (self.sound.keyLatency.mean() * 1000, self.sound.keyLatency.max * 1000)
+		self.statsLabel.setText(text)
+
 	def enableSoundCardBtnClicked(self):
 		if self.enableSoundCardBtn.isChecked():
 			self.sound.setVolume(self.v.value() / 100.0)
-			self.sound.start()
+			if self.lowLatency:
+				self.sound.start(frames_per_buffer=self.sound.LOW_LATENCY_FRAMES_PER_BUFFER, buffers=self.sound.LOW_LATENCY_BUFFERS)
+			else:
+				self.sound.start()
 			self.sendFileBtn.setEnabled(True)
 		else:
 			self.sound.setVolume(0)
@@ -495,56 +982,137 @@ class GUI(QWidget):
 		del self.soundOffTimer
 
 	def closeEvent(self, event):
+		if self.serialPort is not None:
+			self.serialPort.close()
 		self.sound.stop()
 		event.accept()
 
-	def editorTextChanged(self):
-		err = False
-		text = self.editor.toPlainText()
+	def editorContentsChange(self, position, removed, added):
+		# only the edited part of the document is looked at, whatever its size
+		if self.editorResetting:
+			return
+		keyTime, self.editor.keyTime = self.editor.keyTime, None
 
-		if len(text) == self.editor.lastLen - 1:
-			self.sound.write("\x08 \x08")
-			self.editor.lastLen = len(text)
+		if removed:
+			self.sound.write("\x08 \x08" * removed, keyTime)
+			keyTime = None
+		if not added:
 			return
 
-		i = self.editor.lastLen
-		while i < len(text):
+		cursor = QTextCursor(self.editor.document())
+		cursor.setPosition(position)
+		cursor.setPosition(min(position + added, self.editor.document().characterCount() - 1), QTextCursor.KeepAnchor)
+		text = cursor.selectedText()
+		try:
+			self.sound.write(text.replace("\u2029", "\r\n"), keyTime)
+			return
+		except Exception:
+			pass
+
+		# send what can be encoded, and take the rest out of the editor
+		accepted, rejected = [], []
+		for i, c in enumerate(text):
 			try:
-				c = text[i]
-				if c == "\n":
-					c="\r\n"
-				self.sound.write(c)
-				i+=1
+				c.replace("\u2029", "\r\n").encode(self.sound.encoding)
+				accepted.append(c)
 			except Exception as e:
 				print(c+":", e)
-				text = text[:i] + text[i+1:]; err = True
-		self.editor.lastLen = len(text)
+				rejected.append(i)
+		if accepted:
+			self.sound.write("".join(accepted).replace("\u2029", "\r\n"), keyTime)
 
-		if err:
-			self.editor.blockSignals(True)
-			self.editor.setPlainText(text)
-			self.editor.moveCursor(QTextCursor.End)
-			self.editor.blockSignals(False)
+		self.editorResetting = True
+		for i in reversed(rejected):
+			cursor.setPosition(position + i)
+			cursor.setPosition(position + i + 1, QTextCursor.KeepAnchor)
+			cursor.removeSelectedText()
+		self.editorResetting = False
 
 	def editorKeyWithControlPressed(self, key):
+		keyTime, self.editor.keyTime = self.editor.keyTime, None
 		try:
 			if key == Qt.Key_L: # clear screen
-				self.sound.write("\x0c")
+				self.sound.write("\x0c", keyTime)
+				self.editorResetting = True
 				self.editor.setPlainText("")
+				self.editorResetting = False
 			elif key == Qt.Key_G: # bell
-				self.sound.write("\x07")
+				self.sound.write("\x07", keyTime)
 			elif key == Qt.Key_Space:
-				self.sound.write("\x00")
+				self.sound.write("\x00", keyTime)
 			elif Qt.Key_A <= key <= Qt.Key_Z:
 				asc = key - Qt.Key_A + 1
-				self.sound.write("%c" % asc)
+				self.sound.write("%c" % asc, keyTime)
 		except Exception as e:
 			print(e)
 
 
+def renderOffline(args):
+	sound = SoundGenerator(fs=args.fs, debug=args.debug)
+	sound.setBaudRate(args.baud)
+	sound.setBits(args.bits)
+	sound.setParity(args.parity)
+	sound.setStopBits(args.stop_bits)
+	frequencies = list(map(float, args.frequencies.split("/")))
+	sound.setFrequencies(frequencies[0], frequencies[1], frequencies[2] if len(frequencies) > 2 else frequencies[0])
+	sound.setVolume(args.volume)
+	sound.reset(initialBreak=not args.no_break)
+
+	fd = sys.stdin.buffer if args.input == '-' else open(args.input, "rb")
+	buf = np.zeros(sound.FRAMES_PER_BUFFER).astype(np.float32)
+	with PcmWriter(args.render, sound.fs, args.format, args.raw) as writer:
+		eof = False
+		while not eof or sound.queue.qsize() or sound.waitSamples:
+			while not eof and sound.queuedSeconds() < 1.0:
+				data = fd.read(4096)
+				if data == b'':
+					eof = True
+				else:
+					sound.write(data)
+			sound.render(buf)
+			writer.write(buf)
+
+		for i in range(int(round(args.tail * sound.fs / len(buf)))):
+			sound.render(buf)
+			writer.write(buf)
+
+	if fd is not sys.stdin.buffer:
+		fd.close()
+
 def main():
-	app = QApplication(sys.argv)
-	gui = GUI()
+	parser = argparse.ArgumentParser(description="V23 sound generator. Opens the GUI, unless --render is given.")
+	parser.add_argument('--render', metavar='FILE', help="modulate the input offline as fast as possible to a WAV file ('-' for stdout)")
+	parser.add_argument('--input', metavar='FILE', default='-', help="data to transmit with --render ('-' for stdin, default)")
+	parser.add_argument('--raw', action='store_true', help="write raw PCM samples instead of WAV")
+	parser.add_argument('--format', choices=PcmWriter.FORMATS, default='float32', help="sample format (default: %(default)s)")
+	parser.add_argument('--fs', type=int, default=44100, help="sampling rate in Hz (default: %(default)s)")
+	parser.add_argument('--baud', type=float, default=1200, help="transmission rate in bauds (default: %(default)s)")
+	parser.add_argument('--bits', type=int, default=7, help="bits per character (default: %(default)s)")
+	parser.add_argument('--parity', choices=['n', 'e', 'o'], default='e', help="parity (default: %(default)s)")
+	parser.add_argument('--stop-bits', type=float, default=1, help="stop bit duration, in bits (default: %(default)s)")
+	parser.add_argument('--frequencies', default='1300/2100', help="mark/space[/idle] frequencies in Hz (default: %(default)s)")
+	parser.add_argument('--volume', type=float, default=0.1, help="amplitude, from 0 to 1 (default: %(default)s)")
+	parser.add_argument('--no-break', action='store_true', help="start with a short idle period instead of a 2s break")
+	parser.add_argument('--tail', type=float, default=0.5, help="idle time to render after the data, in seconds (default: %(default)s)")
+	parser.add_argument('--debug', action='store_true', help="print the transmitted frames bits")
+	parser.add_argument('--pty', nargs='?', const='', metavar='LINK', help="open a pseudo-terminal to transmit what other programs write to it, with flow control, optionally symlinked as LINK")
+	parser.add_argument('--low-latency', action='store_true', help="small audio buffers, for interactive typing")
+	addStreamArguments(parser, bufferSize=False)
+	addBackendArguments(parser)
+	addTunerArguments(parser)
+	args, qtArgs = parser.parse_known_args()
+
+	if args.render:
+		renderOffline(args)
+		return
+
+	app = QApplication(sys.argv[:1] + qtArgs)
+	gui = GUI(debug=args.debug, backend=makeBackend(args.backend, args.speed), process=args.process, tuner=makeTuner(args), lowLatency=args.low_latency, pty=args.pty)
+	if args.stats_log:
+		# printed from the event loop, away from the audio callback
+		logTimer = QTimer()
+		logTimer.timeout.connect(gui.sound.stats.log)
+		logTimer.start(int(args.stats_log * 1000))
 	ret = app.exec_()
 	sys.exit(ret)
 
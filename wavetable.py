@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+
+# one period of each waveform, phase in [0, 2pi)
+SHAPES = {
+	'sine': lambda phase: np.sin(phase),
+	'sine2': lambda phase: np.sin(phase)**2 * np.where(phase > np.pi, 1, -1), # squared and alternated sinewave
+	'sine3': lambda phase: np.sin(phase)**3,
+	'triangle': lambda phase: np.where(phase <= 0.5*np.pi, phase/(0.5*np.pi), np.where(phase <= 1.5*np.pi, 2-phase/(0.5*np.pi), phase/(0.5*np.pi)-4)),
+	'square': lambda phase: np.where(phase < np.pi, -1.0, 1.0),
+}
+
+# direct digital synthesis: phases are 32 bit unsigned accumulators wrapping around at a whole turn, advanced
+# by a tuning word each sample, so that frequencies are exact to fs/2**32 and don't drift over long runs
+PHASE_BITS = 32
+PHASE_TYPE = np.uint32
+TURN = 1 << PHASE_BITS
+
+def tuningWord(frequency, fs):
+	return int(round(frequency * TURN / fs)) % TURN
+
+def tuningWords(frequencies, fs):
+	return (np.rint(np.asarray(frequencies, dtype=float) * (TURN / fs)).astype(np.int64) % TURN).astype(PHASE_TYPE)
+
+def wordFrequency(word, fs):
+	return float(word) * fs / TURN
+
+def phaseRamp(phase, word, frames):
+	# phases of frames samples from phase on, with the same tuning word
+	return PHASE_TYPE(phase) + PHASE_TYPE(word) * np.arange(frames, dtype=PHASE_TYPE)
+
+def phaseAdvance(phase, word, frames):
+	return (phase + word * frames) % TURN
+
+class Wavetable():
+	# band limited tables of one waveform, mip-mapped by octave: level k keeps the first
+	# MAX_HARMONICS >> k harmonics, and the last level is silent, for frequencies over fs/2.
+	# They don't depend on the sampling rate, only the choice of the level does.
+	# Under fs / (4*MAX_HARMONICS), where level 0 would miss harmonics below fs/2, the waveform
+	# is computed exactly at each phase instead, its aliases are then negligible.
+	INDEX_BITS = 12
+	SIZE = 1 << INDEX_BITS
+	FRACTION_BITS = PHASE_BITS - INDEX_BITS # of the phases, between two samples of the tables
+	MAX_HARMONICS = 1024
+	OVERSAMPLING = 16 # of the naive waveform, to compute its harmonics
+	CACHE_VERSION = 3 # of the tables layout and scaling, in the cache file names
+
+	def __init__(self, shape, cacheDir=None):
+		if shape not in SHAPES:
+			raise Exception("Unknown waveform %s, should be one of %s!" % (shape, ", ".join(SHAPES)))
+		self.shape = shape
+		self.levelsNbr = int(np.log2(self.MAX_HARMONICS)) + 2
+
+		filename = os.path.join(cacheDir, "wavetable-%s-%d-%d-v%d.npz" % (shape, self.SIZE, self.MAX_HARMONICS, self.CACHE_VERSION)) if cacheDir else None
+		if filename and os.path.exists(filename):
+			with np.load(filename) as cached:
+				self.levels = cached['levels']
+				self.gain = float(cached['gain'])
+		else:
+			self.levels, self.gain = self.build()
+			if filename:
+				os.makedirs(cacheDir, exist_ok=True)
+				np.savez(filename, levels=self.levels, gain=self.gain)
+
+	def build(self):
+		# harmonics of the naive waveform, taking the middle of its steps
+		n = self.SIZE * self.OVERSAMPLING
+		phase = 2*np.pi*np.arange(n)/n
+		f = SHAPES[self.shape]
+		naive = 0.5 * (f(np.mod(phase + 1e-9, 2*np.pi)) + f(np.mod(phase - 1e-9, 2*np.pi)))
+		spectrum = np.fft.rfft(naive)
+
+		# with 2 more samples, for the interpolation not to wrap around
+		levels = np.zeros((self.levelsNbr, self.SIZE + 2))
+		for level in range(self.levelsNbr - 1):
+			s = np.zeros(self.SIZE // 2 + 1, dtype=complex)
+			harmonics = self.MAX_HARMONICS >> level
+			s[1:harmonics+1] = spectrum[1:harmonics+1] / self.OVERSAMPLING
+			levels[level, :self.SIZE] = np.fft.irfft(s, self.SIZE)
+		# no overshoot (Gibbs) over full scale, with the same gain on all levels for the harmonics
+		# not to change level from one octave to the next
+		gain = 1.0 / max(1.0, np.abs(levels).max())
+		levels*=gain
+		levels[:, self.SIZE:] = levels[:, :2]
+		return levels, gain
+
+	def isExact(self, frequency, fs):
+		return abs(frequency) * 4 * self.MAX_HARMONICS < fs
+
+	def level(self, frequency, fs):
+		# first level without harmonics over fs/2
+		if frequency <= 0:
+			return 0
+		harmonics = fs / (2.0 * abs(frequency))
+		if harmonics < 1:
+			return self.levelsNbr - 1
+		return int(min(self.levelsNbr - 2, max(0, np.log2(self.MAX_HARMONICS) - np.floor(np.log2(harmonics)))))
+
+	def render(self, phase, frequency, fs):
+		if self.isExact(frequency, fs):
+			return self.gain * SHAPES[self.shape](phase * (2*np.pi / TURN))
+		# linear interpolation in the table of the highest frequency played, at the DDS phases
+		table = self.levels[self.level(frequency, fs)]
+		i = phase >> PHASE_TYPE(self.FRACTION_BITS)
+		x = (phase & PHASE_TYPE((1 << self.FRACTION_BITS) - 1)) * (1.0 / (1 << self.FRACTION_BITS))
+		a = table[i]
+		return a + x * (table[i+1] - a)
+
+# built once per process
+wavetables = {}
+
+def getWavetable(shape, cacheDir=None):
+	if shape not in wavetables:
+		wavetables[shape] = Wavetable(shape, cacheDir)
+	return wavetables[shape]